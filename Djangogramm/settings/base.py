@@ -1,3 +1,4 @@
+from datetime import timedelta
 from pathlib import Path
 import environ
 import os
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -153,3 +155,96 @@ SOCIALACCOUNT_PROVIDERS = {
 }
 
 LOGIN_REDIRECT_URL = '/'
+
+
+# timeline
+
+# Authors with more followers than this are merged into timelines on read instead of fanned out on write
+TIMELINE_FANOUT_LIMIT = 10000
+TIMELINE_BACKFILL_SIZE = 100
+# Seconds a user's set of followed ids stays cached, it is also dropped on every follow change
+FOLLOWED_IDS_TIMEOUT = 10 * 60
+SUGGESTIONS_PER_USER = 10
+# A shared tag counts for half a mutual follow
+SUGGESTIONS_TAG_WEIGHT = 0.5
+# Followers of a user, most recent first, whose suggestions one of their follow changes rescores at most
+SUGGESTIONS_REFRESH_LIMIT = 1000
+
+
+# background tasks
+
+BACKGROUND_WORKERS = 2
+# Run tasks in the request thread right after commit instead of the thread pool (tests, debugging)
+BACKGROUND_TASKS_EAGER = False
+
+
+# uploads
+
+# Stream every upload to a temporary file instead of buffering small ones in memory
+FILE_UPLOAD_HANDLERS = ['posts.uploadhandlers.LimitedTemporaryFileUploadHandler']
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2 * 1024 * 1024
+IMAGE_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+# Decompression bomb guard, a 12 MP photo is well below it
+IMAGE_MAX_PIXELS = 50_000_000
+# Seconds after which an image still pending or processing is presumed lost with its worker and queued again
+IMAGE_PROCESSING_TIMEOUT = 15 * 60
+# Hamming distance in bits under which two post images count as the same picture
+PHASH_MAX_DISTANCE = 6
+
+
+# cache
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+# Feed card fragments are invalidated explicitly, the timeout only bounds stale entries
+CARD_FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+
+# tags
+
+TRENDING_HALF_LIFE = timedelta(hours=12)
+# Trending scores below this are dropped
+TRENDING_MIN_SCORE = 0.05
+# Seconds the in-memory autocomplete index is served before it is reloaded
+TAG_INDEX_TTL = 300
+
+
+# search
+
+# Dotted path of the search backend, by default PostgreSQL full-text search or an in-memory index elsewhere
+SEARCH_BACKEND = None
+SEARCH_USERS_SHOWN = 5
+
+
+# comments
+
+COMMENTS_PAGE_SIZE = 20
+# Upper bound of ?limit= on comment pages
+COMMENTS_PAGE_MAX_SIZE = 100
+
+
+# likes
+
+# Buffer post likes in the worker and write them in batches, see posts/like_buffer.py
+LIKE_WRITE_BEHIND = False
+LIKE_BUFFER_SIZE = 500
+# Seconds a like may wait in the buffer
+LIKE_BUFFER_INTERVAL = 2
+
+
+# request metrics
+
+# Query count and milliseconds allowed per URL name, '*' for the others; requests over them are logged
+REQUEST_BUDGETS = {
+    '*': {'queries': 20, 'ms': 500},
+    'post_page': {'queries': 12},
+    'post_comments': {'queries': 8},
+    'tag_autocomplete': {'queries': 2, 'ms': 100},
+}
+REQUEST_STATS_MS_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+REQUEST_STATS_QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+# Send the Server-Timing header to every client, not only to staff users
+SERVER_TIMING_HEADER = False
@@ -2,6 +2,7 @@ from .base import *
 
 SECRET_KEY = 'django-insecure-lr=bw=_l&+(yf45d9-o6ip6^h&%82ou1ah82@7on*l@d(ml@8f'
 DEBUG = True
+SERVER_TIMING_HEADER = DEBUG
 
 DATABASES = {
     'default': {
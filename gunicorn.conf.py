@@ -0,0 +1,4 @@
+def worker_exit(server, worker):
+    # Likes buffered in write-behind mode would be lost with the worker
+    from posts.like_buffer import buffer
+    buffer.flush()
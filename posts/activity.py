@@ -0,0 +1,61 @@
+"""Reactions to a user's content, merged in the database from one UNION ALL of every kind of activity."""
+from django.db import connection
+from django.db.models import BigIntegerField, CharField, DateTimeField, F, Q, TextField, UUIDField, Value
+
+from .models import Comment, LikeComment, LikePost, Subscription
+from .pagination import CursorPaginator
+
+
+def _branch(queryset, kind, actor, post=None, text=None):
+    """Shape one kind of activity into the shared (id, created_at, kind, actor, target_post, body) row."""
+    return kind, queryset.annotate(
+        kind=Value(kind, output_field=CharField()),
+        actor=F(actor),
+        target_post=F(post) if post else Value(None, output_field=UUIDField()),
+        body=F(text) if text else Value(None, output_field=TextField()),
+    ).values('id', 'created_at', 'kind', 'actor', 'target_post', 'body')
+
+
+def reactions_to(user):
+    return [
+        _branch(Comment.objects.filter(post__user=user), 'comment', 'user__username', 'post_id', 'text'),
+        _branch(LikePost.objects.filter(post__user=user), 'post_like', 'user__username', 'post_id'),
+        _branch(LikeComment.objects.filter(comment__user=user), 'comment_like', 'user__username', 'comment__post_id'),
+        _branch(Subscription.objects.filter(followed=user), 'follow', 'follower__username'),
+    ]
+
+
+class ActivityPaginator(CursorPaginator):
+    """
+    Keyset paginator over the (kind, queryset) branches of `reactions_to`, ordered by (created_at, kind, id).
+
+    The cursor condition is pushed into every branch and, where the database allows it, each branch is
+    limited to one page before the union, so a page never sorts more than 4 * (per_page + 1) rows.
+    """
+
+    fields_python = {'created_at': DateTimeField(), 'kind': CharField(), 'id': BigIntegerField()}
+
+    def __init__(self, branches, per_page, ordering=('-created_at', '-kind', '-id')):
+        super().__init__(branches, per_page, ordering)
+
+    def after(self, cursor=None):
+        values = self.decode(cursor) if cursor else None
+        queries = []
+        for kind, queryset in self.queryset:
+            if values:
+                queryset = queryset.filter(self._branch_after(kind, *values))
+            if connection.features.supports_slicing_ordering_in_compound:
+                queryset = queryset.order_by('-created_at', '-id')[:self.per_page + 1]
+            queries.append(queryset)
+        return queries[0].union(*queries[1:], all=True).order_by(*self.ordering)
+
+    @staticmethod
+    def _branch_after(kind, created_at, cursor_kind, cursor_id):
+        if kind < cursor_kind:
+            return Q(created_at__lte=created_at)
+        if kind == cursor_kind:
+            return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=cursor_id)
+        return Q(created_at__lt=created_at)
+
+    def _to_python(self, name, value):
+        return self.fields_python[name].to_python(value)
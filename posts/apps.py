@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PostsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'posts'
+
+    def ready(self):
+        from PIL import Image
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
+
+        from . import signals  # noqa: F401
@@ -0,0 +1,121 @@
+"""
+Benchmark harness: time the main pages against the synthetic dataset of posts.datagen.
+
+`run` requests every scenario through the test client and reports latency percentiles and query counts,
+stored as JSON by the run_benchmark command so runs of different commits can be compared.
+"""
+import math
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .datagen import PREFIX
+from .models import Comment, LikeComment, LikePost, Post, Subscription, Tag, User
+
+
+def scenarios():
+    """
+    (name, method, url, user) of every benchmarked request, on the most popular benchmark rows. `user` is who
+    sends it, the viewer() when None: the reactions page shows the reactions to its visitor's own posts.
+    """
+    author = _most_followed()
+    posts = Post.objects.filter(user__username__startswith=PREFIX)
+    post = posts.order_by('-likes_count', '-comments_count', 'pk').first()
+    tag = (Tag.objects.filter(name__startswith=PREFIX).annotate(posts=Count('users'))
+           .order_by('-posts', 'pk').first())
+
+    return [
+        ('index', 'get', reverse('index'), None),
+        ('user_page', 'get', reverse('user_page', kwargs={'username': author.username}), None),
+        ('tag_page', 'get', reverse('tag_page', kwargs={'name': tag.name}) if tag else None, None),
+        ('post_page', 'get', reverse('post_page', kwargs={'post_id': post.id}) if post else None, None),
+        ('reactions_page', 'get', reverse('reactions_page', kwargs={'username': author.username}), author),
+        ('like_toggle', 'post', reverse('like_post', kwargs={'post_id': post.id}) if post else None, None),
+        ('follow_toggle', 'post', reverse('follow_user', kwargs={'user_id': author.id}), None),
+    ]
+
+
+def _most_followed():
+    author = User.objects.filter(username__startswith=PREFIX).order_by('-followers_count', 'pk').first()
+    if author is None:
+        raise LookupError('No benchmark data, run seed_benchmark first')
+    return author
+
+
+def viewer():
+    """The benchmark user following the most others, apart from the most followed one, the follow_toggle target."""
+    users = User.objects.filter(username__startswith=PREFIX).exclude(pk=_most_followed().pk)
+    return users.order_by('-following_count', 'pk').first()
+
+
+def _percentile(samples, fraction):
+    """Nearest-rank percentile: the smallest sample at least `fraction` of the samples are not above."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def run(rounds=20, warmup=3, only=None):
+    """Time every scenario `rounds` times after `warmup` untimed requests, as {name: summary}."""
+    client = Client()
+    default_user = viewer()
+    results = {}
+
+    # Background tasks run inside the request that queues them, not in threads racing the next scenarios:
+    # follow_toggle includes its suggestion refresh
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], BACKGROUND_TASKS_EAGER=True):
+        for name, method, url, user in scenarios():
+            if url is None or (only and name not in only):
+                continue
+            client.force_login(user or default_user)
+            request = getattr(client, method)
+            for _ in range(warmup):
+                request(url)
+
+            timings, queries = [], []
+            for _ in range(rounds):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = request(url)
+                    timings.append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 400:
+                    raise RuntimeError(f'{name}: {method.upper()} {url} answered {response.status_code}')
+                queries.append(len(captured))
+
+            # Toggles flip state every request, leave it as it was
+            if method == 'post' and (warmup + rounds) % 2:
+                request(url)
+
+            results[name] = {
+                'url': url,
+                'user': (user or default_user).username,
+                'queries': max(queries),
+                'min_ms': round(min(timings), 2),
+                'median_ms': round(statistics.median(timings), 2),
+                'p95_ms': round(_percentile(timings, 0.95), 2),
+                'max_ms': round(max(timings), 2),
+            }
+    return results
+
+
+def environment():
+    """What a result was measured on: commit, database and data volumes."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'measured_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'rows': {model._meta.model_name: model.objects.count()
+                 for model in (User, Post, Tag, Comment, LikePost, LikeComment, Subscription)},
+    }
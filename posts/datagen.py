@@ -0,0 +1,311 @@
+"""
+Synthetic data for load tests and benchmarks.
+
+`generate` streams bench_ users, tags, posts, comments, likes and follows from generators into `load`, so memory
+stays flat whatever the volume: row ids are derived from the seed and the row number instead of being kept,
+and only comment ids, assigned by the database, are read back into a compact array. Popularity follows power
+laws, a few users get most of the follows and a few posts, comments and tags most of the activity.
+
+`load` sends rows to PostgreSQL with COPY through a staging table, so duplicate likes and follows are dropped
+by ON CONFLICT DO NOTHING, and falls back to chunked bulk_create elsewhere.
+
+Rows are loaded without signals, so what they would maintain is derived once everything is in: counters,
+the timeline entries fan-out on write would have pushed, and search vectors or the in-memory search index.
+"""
+import hashlib
+import io
+import json
+import random
+import uuid
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection, models, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import images, search
+from .models import Comment, ImageStatus, LikeComment, LikePost, Post, Subscription, Tag, TimelineEntry, User
+
+PREFIX = 'bench_'
+
+VOLUMES = {
+    'users': 1000,
+    'posts': 10000,
+    'tags': 200,
+    'comments': 20000,
+    'likes': 100000,
+    'comment_likes': 20000,
+    'follows': 20000,
+}
+
+# Power law exponents: followers per user, activity per post and comment, posts per tag
+FOLLOW_EXPONENT = 1.0
+ACTIVITY_EXPONENT = 1.2
+TAG_EXPONENT = 1.1
+
+
+def zipf(rng, n, exponent):
+    """
+    A rank below n drawn from a bounded power law, P(rank k) ~ (k + 1) ** -exponent, by inverting its
+    continuous CDF: constant time and memory where a table of n weights would not be.
+    """
+    u = rng.random()
+    if exponent == 1:
+        x = (n + 1) ** u
+    else:
+        x = (((n + 1) ** (1 - exponent) - 1) * u + 1) ** (1 / (1 - exponent))
+    return min(int(x) - 1, n - 1)
+
+
+def row_uuid(seed, kind, i):
+    """UUID primary key of the i-th generated row of a kind, the same for the same seed."""
+    return uuid.UUID(bytes=hashlib.blake2b(f'{seed}:{kind}:{i}'.encode(), digest_size=16).digest(), version=4)
+
+
+@contextmanager
+def _explicit_timestamps(*models):
+    """Let bulk inserts keep the generated created_at/updated_at instead of the current time."""
+    fields = [(field, field.auto_now, field.auto_now_add) for model in models for field in model._meta.fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    for field, _, _ in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in fields:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _copy_text(field, obj):
+    """A field value of `obj` in COPY text format."""
+    value = field.get_prep_value(field.pre_save(obj, add=True))
+    if value is None:
+        return r'\N'
+    if isinstance(field, models.JSONField):
+        value = json.dumps(value, cls=field.encoder)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _CopyStream:
+    """Read-only file over an iterator of COPY lines, pulled as psycopg2 reads."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+            self.count += 1
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def _copy(model, rows):
+    fields = [field for field in model._meta.concrete_fields if field is not model._meta.auto_field]
+    quote = connection.ops.quote_name
+    table, staging = quote(model._meta.db_table), quote(f'{model._meta.db_table}_staging')
+    columns = ', '.join(quote(field.column) for field in fields)
+    stream = _CopyStream('\t'.join(_copy_text(field, obj) for field in fields) + '\n' for obj in rows)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Without the table's constraints, the INSERT below skips the rows that would violate them
+        cursor.execute(f'CREATE TEMPORARY TABLE {staging} AS SELECT {columns} FROM {table} WITH NO DATA')
+        cursor.copy_expert(f'COPY {staging} ({columns}) FROM STDIN', stream)
+        cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} ON CONFLICT DO NOTHING')
+        cursor.execute(f'DROP TABLE {staging}')
+    return stream.count
+
+
+def _bulk_create(model, rows, batch_size):
+    batch, sent = [], 0
+    for obj in rows:
+        batch.append(obj)
+        if len(batch) == batch_size:
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+            sent += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+        sent += len(batch)
+    return sent
+
+
+def load(model, rows, batch_size=5000):
+    """
+    Insert the unsaved objects `rows` yields, skipping those that conflict with existing rows, with COPY on
+    PostgreSQL or bulk_create `batch_size` at a time elsewhere. Returns how many were sent.
+    """
+    if connection.vendor == 'postgresql':
+        return _copy(model, rows)
+    return _bulk_create(model, rows, batch_size)
+
+
+def generate(volumes=None, batch_size=5000, days=365, seed=0, log=lambda message: None):
+    """Insert a synthetic dataset of the given VOLUMES. Duplicate likes and follows are dropped, not replaced."""
+    volumes = {**VOLUMES, **(volumes or {})}
+    rng = random.Random(seed)
+    now = timezone.now()
+    span = days * 24 * 60 * 60
+    users, posts = volumes['users'], volumes['posts']
+
+    def moment():
+        return now - timedelta(seconds=rng.uniform(0, span))
+
+    def user_id(i):
+        return row_uuid(seed, 'user', i)
+
+    def post_id(i):
+        return row_uuid(seed, 'post', i)
+
+    def any_user():
+        return user_id(rng.randrange(users))
+
+    def popular_post():
+        return post_id(zipf(rng, posts, ACTIVITY_EXPONENT))
+
+    # Hashing is slow by design, every generated user shares the password 'bench'
+    password = make_password('bench')
+
+    def user_rows():
+        for i in range(users):
+            yield User(id=user_id(i), username=f'{PREFIX}{i}', password=password, nickname=f'Bench user {i}',
+                       date_joined=now - timedelta(days=days))
+
+    def post_rows():
+        for i in range(posts):
+            created_at = moment()
+            yield Post(id=post_id(i), user_id=any_user(), image='posts_images/benchmark.jpg',
+                       image_status=ImageStatus.READY, description=f'Benchmark post {i}',
+                       created_at=created_at, updated_at=created_at)
+
+    def post_tag_rows(tags):
+        for i in range(posts):
+            for tag in {tags[zipf(rng, len(tags), TAG_EXPONENT)] for _ in range(rng.randint(0, 3))}:
+                yield Post.tags.through(post_id=post_id(i), tag_id=tag.pk)
+
+    def comment_rows():
+        for _ in range(volumes['comments']):
+            created_at = moment()
+            yield Comment(post_id=popular_post(), user_id=any_user(), text='Benchmark comment',
+                          created_at=created_at, updated_at=created_at)
+
+    def like_rows():
+        for _ in range(volumes['likes']):
+            yield LikePost(post_id=popular_post(), user_id=any_user(), created_at=moment())
+
+    def comment_like_rows(comment_ids):
+        for _ in range(volumes['comment_likes']):
+            comment = comment_ids[zipf(rng, len(comment_ids), ACTIVITY_EXPONENT)]
+            yield LikeComment(comment_id=comment, user_id=any_user(), created_at=moment())
+
+    def follow_rows():
+        for _ in range(volumes['follows']):
+            follower, followed = any_user(), user_id(zipf(rng, users, FOLLOW_EXPONENT))
+            if follower != followed:
+                yield Subscription(follower_id=follower, followed_id=followed, created_at=moment())
+
+    with _explicit_timestamps(Post, Comment, LikePost, LikeComment, Subscription), transaction.atomic():
+        log(f'{load(User, user_rows(), batch_size)} users')
+        tags = Tag.objects.bulk_upsert(f'{PREFIX}tag{i}' for i in range(volumes['tags']))
+        log(f'{len(tags)} tags')
+        if not users:
+            return
+
+        log(f'{load(Post, post_rows(), batch_size)} posts')
+        if tags:
+            log(f'{load(Post.tags.through, post_tag_rows(tags), batch_size)} post tags')
+        if posts:
+            log(f'{load(Comment, comment_rows(), batch_size)} comments')
+            log(f'{load(LikePost, like_rows(), batch_size)} likes sent')
+
+        comment_ids = array('q', Comment.objects.filter(user__username__startswith=PREFIX)
+                            .values_list('id', flat=True).iterator(chunk_size=batch_size))
+        if comment_ids:
+            log(f'{load(LikeComment, comment_like_rows(comment_ids), batch_size)} comment likes sent')
+        log(f'{load(Subscription, follow_rows(), batch_size)} follows sent')
+
+    call_command('recount_counters', stdout=io.StringIO())
+    log(f'{fan_out(batch_size)} timeline entries sent')
+    reindex()
+
+
+def fan_out(batch_size=5000):
+    """
+    Push every generated post into the timelines of its author's followers, as timeline.fan_out does when a
+    post is created, after switching authors over TIMELINE_FANOUT_LIMIT followers to fan-out on read.
+    Returns how many entries were sent.
+    """
+    users = User.objects.filter(username__startswith=PREFIX)
+    users.filter(followers_count__gt=settings.TIMELINE_FANOUT_LIMIT).update(fanout_on_read=True)
+    pushed = Post.objects.filter(user__in=users.filter(fanout_on_read=False), user__followers__isnull=False)\
+        .values_list('user__followers__follower', 'id', 'created_at')
+    rows = (TimelineEntry(user_id=follower_id, post_id=post_id, created_at=created_at)
+            for follower_id, post_id, created_at in pushed.iterator(chunk_size=batch_size))
+    with transaction.atomic():
+        return load(TimelineEntry, rows, batch_size)
+
+
+def reindex():
+    """Make the generated users, posts and comments searchable, as the search signals do for saved rows."""
+    backend = search.get_backend()
+    if isinstance(backend, search.PostgresSearchBackend):
+        for model, rows in ((User, User.objects.filter(username__startswith=PREFIX)),
+                            (Post, Post.objects.filter(user__username__startswith=PREFIX)),
+                            (Comment, Comment.objects.filter(user__username__startswith=PREFIX))):
+            rows.update(search_vector=backend.vector(model))
+    elif isinstance(backend, search.InvertedIndexBackend):
+        # Loaded again from the database on the next search
+        backend.reset()
+
+
+def _raw_delete(queryset):
+    """
+    Delete `queryset` and, before it, the rows cascading from it, with one DELETE per table on a subquery of the
+    rows above it: what the deletion collector does, without loading any row nor sending a signal per row.
+    Returns how many rows were deleted.
+    """
+    deleted = 0
+    for relation in queryset.model._meta.get_fields(include_hidden=True):
+        # Reverse foreign keys, the hidden ones of many-to-many through tables included
+        if not (relation.auto_created and not relation.concrete and (relation.one_to_many or relation.one_to_one)):
+            continue
+        rows = relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': queryset.values('pk')})
+        if relation.on_delete is models.CASCADE:
+            deleted += _raw_delete(rows)
+        elif relation.on_delete is models.SET_NULL:
+            rows.update(**{relation.field.name: None})
+    return deleted + queryset._raw_delete(queryset.db)
+
+
+def flush():
+    """
+    Delete every generated user and tag with what cascades from them, then fix what the skipped post_delete
+    signals and the deleted likes, comments and follows of other users' rows leave behind: counters, image
+    references and the search index. Returns how many rows were deleted.
+    """
+    users = User.objects.filter(username__startswith=PREFIX)
+    references = Counter()
+    for rows in (users, Post.objects.filter(user__in=users)):
+        references.update(dict(rows.exclude(image_blob=None).order_by().values_list('image_blob')
+                               .annotate(n=Count('pk'))))
+
+    with transaction.atomic():
+        deleted = _raw_delete(Tag.objects.filter(name__startswith=PREFIX)) + _raw_delete(users)
+        for blob_id, count in references.items():
+            images.release_blob(blob_id, count)
+    call_command('recount_counters', stdout=io.StringIO())
+    reindex()
+    return deleted
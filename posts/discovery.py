@@ -0,0 +1,91 @@
+"""
+Tag discovery: trending tags and tag autocomplete.
+
+Trending scores are post counts decaying with a half-life of TRENDING_HALF_LIFE, an exponential sliding
+window. A refresh decays every score in one UPDATE and adds only the Post.tags links created since the
+previous refresh, found by link id, so its cost depends on the new links rather than on the history.
+
+Autocomplete is served from a per-process index of every tag name kept sorted for bisection, reloaded
+from the database every TAG_INDEX_TTL seconds.
+"""
+import heapq
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from .models import normalize_tag, Post, Tag, TagTrend
+
+
+def refresh_trending(now=None):
+    """Bring trending scores up to date, returns the number of tags that got new posts."""
+    now = now or timezone.now()
+    links = Post.tags.through.objects
+
+    with transaction.atomic():
+        state = TagTrend.objects.aggregate(watermark=Max('last_link_id'), scored_at=Max('scored_at'))
+        if state['scored_at'] is not None:
+            factor = 0.5 ** ((now - state['scored_at']) / settings.TRENDING_HALF_LIFE)
+            TagTrend.objects.update(score=F('score') * factor, scored_at=now)
+
+        new_links = links.filter(id__gt=state['watermark'] or 0).values('tag_id').order_by().annotate(
+            posts=Count('id'), last_link_id=Max('id')
+        )
+        trends = TagTrend.objects.in_bulk([row['tag_id'] for row in new_links])
+        created, updated = [], []
+        for row in new_links:
+            trend = trends.get(row['tag_id'])
+            if trend is None:
+                created.append(TagTrend(tag_id=row['tag_id'], score=row['posts'], scored_at=now,
+                                        last_link_id=row['last_link_id']))
+            else:
+                trend.score += row['posts']
+                trend.last_link_id = row['last_link_id']
+                updated.append(trend)
+        TagTrend.objects.bulk_create(created)
+        TagTrend.objects.bulk_update(updated, ['score', 'last_link_id'])
+
+        # Faded tags leave the table, except the one holding the watermark
+        watermark = TagTrend.objects.aggregate(watermark=Max('last_link_id'))['watermark']
+        TagTrend.objects.filter(score__lt=settings.TRENDING_MIN_SCORE).exclude(last_link_id=watermark).delete()
+    return len(created) + len(updated)
+
+
+def trending_tags(limit=10):
+    return Tag.objects.filter(trend__score__gte=settings.TRENDING_MIN_SCORE).order_by('-trend__score')[:limit]
+
+
+class TagIndex:
+    """Tag names in sorted order with their number of posts; prefix matches are a contiguous slice."""
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.names = sorted(counts)
+
+    @classmethod
+    def load(cls):
+        return cls(dict(Tag.objects.annotate(posts=Count('users')).values_list('name', 'posts')))
+
+    def complete(self, prefix, limit=10):
+        """The most used tags starting with `prefix`."""
+        prefix = normalize_tag(prefix)
+        if not prefix:
+            return []
+        start = bisect_left(self.names, prefix)
+        end = bisect_right(self.names, prefix + '\U0010ffff', start)
+        return heapq.nsmallest(limit, self.names[start:end], key=lambda name: (-self.counts[name], name))
+
+
+_index = None
+_index_loaded_at = 0.0
+
+
+def tag_index():
+    global _index, _index_loaded_at
+    if _index is None or time.monotonic() - _index_loaded_at >= settings.TAG_INDEX_TTL:
+        _index = TagIndex.load()
+        _index_loaded_at = time.monotonic()
+    return _index
@@ -1,8 +1,28 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserChangeForm, UserCreationForm, AuthenticationForm
+from django.template.defaultfilters import filesizeformat
+from django.urls import reverse_lazy
 
 from .models import Post, Comment, User
 
+# Picked up by the script in posts/tag_autocomplete.html
+TAG_AUTOCOMPLETE_ATTRS = {
+    'class': 'tag-autocomplete',
+    'autocomplete': 'off',
+    'list': 'tag-suggestions',
+    'data-url': reverse_lazy('tag_autocomplete'),
+}
+
+
+def validate_image_upload(image):
+    if image.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise forms.ValidationError(f'Image must be smaller than {filesizeformat(settings.IMAGE_UPLOAD_MAX_SIZE)}.')
+    # Set by forms.ImageField after Pillow read the header, the pixels themselves are never decoded here
+    width, height = image.image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise forms.ValidationError('Image resolution is too large.')
+
 
 class UserRegisterForm(UserCreationForm):
     username = forms.CharField(required=True, widget=forms.TextInput(attrs={
@@ -37,12 +57,12 @@ class UserAuthenticationForm(AuthenticationForm):
 
 
 class PostForm(forms.ModelForm):
-    image = forms.ImageField()
+    image = forms.ImageField(validators=[validate_image_upload])
     description = forms.CharField(
         widget=forms.TextInput(attrs={'placeholder': 'Photo description'})
     )
     tags = forms.CharField(
-        widget=forms.TextInput(attrs={'placeholder': 'Enter tags separated by commas'})
+        widget=forms.TextInput(attrs={'placeholder': 'Enter tags separated by commas', **TAG_AUTOCOMPLETE_ATTRS})
     )
 
     class Meta:
@@ -76,7 +96,7 @@ class UserUpdateForm(UserChangeForm):
     email = forms.EmailField(required=False, widget=forms.EmailInput(attrs={
         'placeholder': 'Fill this field if you want to change your email'
     }))
-    image = forms.ImageField(required=False)
+    image = forms.ImageField(required=False, validators=[validate_image_upload])
 
     password = None
 
@@ -90,7 +110,7 @@ class AddPostTagsForm(forms.Form):
         required=False,
         label='Tags',
         max_length=100,
-        widget=forms.TextInput(attrs={'placeholder': 'Enter tags separated by commas'})
+        widget=forms.TextInput(attrs={'placeholder': 'Enter tags separated by commas', **TAG_AUTOCOMPLETE_ATTRS})
     )
 
 
@@ -0,0 +1,58 @@
+"""
+Fragment cache of feed cards.
+
+The parts of a post card that rarely change (image, tags, description) are rendered once and cached per post
+version, keyed by its updated_at: an edit handled by one process is never served stale from another process's
+cache. Author, timestamp, counters and the viewer's like state are rendered around the fragment on every
+request, so a like never makes a new version.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .middleware import record_cache
+
+PARTS = {
+    'image': 'posts/post_card_image.html',
+    'details': 'posts/post_card_details.html',
+}
+
+
+def card_key(post_id, updated_at):
+    """
+    Cache key of one version of a post's card. Every change of the post moves updated_at, so no process, whatever
+    its cache, serves a card of an older version.
+    """
+    return f'post_card:{post_id}:{updated_at.timestamp()}'
+
+
+def attach_card_fragments(posts):
+    """Set `card_fragment` on a page of posts with one cache read, rendering and storing only the misses."""
+    posts = {card_key(post.id, post.updated_at): post for post in posts}
+    fragments = cache.get_many(posts)
+    record_cache(len(fragments), len(posts) - len(fragments))
+
+    missing = {}
+    for key, post in posts.items():
+        if key not in fragments:
+            missing[key] = {part: render_to_string(template, {'post': post}) for part, template in PARTS.items()}
+    if missing:
+        cache.set_many(missing, settings.CARD_FRAGMENT_TIMEOUT)
+    fragments.update(missing)
+
+    for key, post in posts.items():
+        post.card_fragment = {part: mark_safe(html) for part, html in fragments[key].items()}
+
+
+def invalidate(*posts):
+    """Free the cached cards of these post versions, they can no longer be requested anyway."""
+    cache.delete_many([card_key(post.id, post.updated_at) for post in posts])
+
+
+def touch(posts, **fields):
+    """Update a queryset of posts to a new card version, along with `fields`, for changes save() does not see."""
+    stale = [card_key(post_id, updated_at) for post_id, updated_at in posts.values_list('id', 'updated_at')]
+    posts.update(updated_at=timezone.now(), **fields)
+    cache.delete_many(stale)
@@ -0,0 +1,231 @@
+"""
+Follow graph of users: every follow and unfollow goes through here so that counters, timelines, the
+followed-ids cache and suggestions stay in step with the Subscription rows.
+
+The ids a user follows are cached per user so that is-following checks, for one profile or a whole page of
+authors, cost one cache hit. The key includes User.follows_version, bumped in the database by every follow
+change, so no process reads a set cached before the change, whichever cache it has.
+
+"People you may know" are friends of friends, scored by how many of the user's followed users follow them
+and by the tags both post with. They are computed in batches of users with a few GROUP BY queries and
+stored as the top SUGGESTIONS_PER_USER FollowSuggestion rows, so showing them is one indexed read.
+A follow change then rescores only what it affects: the follower's own suggestions, and the followed users as
+candidates of the follower's followers.
+"""
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from .middleware import record_cache
+from .models import count_of, FollowSuggestion, Post, Subscription, User
+from .tasks import enqueue
+from . import timeline
+
+
+def _followed_key(user):
+    return f'followed_ids:{user.pk}:{user.follows_version}'
+
+
+def followed_ids(user):
+    """Set of the ids of the users `user` follows, empty for anonymous users."""
+    if not user.is_authenticated:
+        return frozenset()
+    key = _followed_key(user)
+    ids = cache.get(key)
+    record_cache(ids is not None, ids is None)
+    if ids is None:
+        ids = frozenset(Subscription.objects.filter(follower=user).values_list('followed_id', flat=True))
+        cache.set(key, ids, settings.FOLLOWED_IDS_TIMEOUT)
+    return ids
+
+
+def followers(user):
+    return User.objects.filter(following__followed=user)
+
+
+def following(user):
+    return User.objects.filter(followers__follower=user)
+
+
+def is_following_many(follower, users):
+    """Ids of those of `users` that `follower` follows, from the followed-ids cache."""
+    return followed_ids(follower) & {user.pk for user in users}
+
+
+def mutual_follows(user, users=None):
+    """Ids of the users following `user` back among those `user` follows (or among `users`), in one query."""
+    mutual = Subscription.objects.filter(follower=user, followed__following__followed=user)
+    if users is not None:
+        mutual = mutual.filter(followed__in=users)
+    return set(mutual.values_list('followed', flat=True))
+
+
+def _recount(user_ids):
+    User.objects.filter(pk__in=user_ids).update(
+        followers_count=count_of(Subscription, 'followed'),
+        following_count=count_of(Subscription, 'follower'),
+    )
+
+
+def _followed_changed(follower, followed_ids):
+    # The cached set of the old version is no longer read, free it here at least
+    transaction.on_commit(lambda: cache.delete(_followed_key(follower)))
+    refresh_suggestions_later(follower, followed_ids)
+
+
+def toggle_follow(follower, followed):
+    """Follow or unfollow, keeping both users' counters in step. Returns (is_following, changed)."""
+    with transaction.atomic():
+        is_following, changed = Subscription.objects.toggle(follower=follower, followed=followed)
+        if changed:
+            step = 1 if is_following else -1
+            User.objects.filter(pk=followed.pk).update(followers_count=F('followers_count') + step)
+            User.objects.filter(pk=follower.pk).update(
+                following_count=F('following_count') + step, follows_version=F('follows_version') + 1
+            )
+            if is_following:
+                timeline.backfill(follower, followed)
+            else:
+                timeline.prune(follower, followed)
+            _followed_changed(follower, [followed.pk])
+    return is_following, changed
+
+
+def follow_many(follower, users):
+    """Follow every user of `users` not followed yet, returns the number of new follows."""
+    ids = {user.pk for user in users} - {follower.pk}
+    with transaction.atomic():
+        new = ids - set(Subscription.objects.filter(follower=follower, followed__in=ids)
+                        .values_list('followed', flat=True))
+        if not new:
+            return 0
+        Subscription.objects.bulk_create(
+            [Subscription(follower=follower, followed_id=user_id) for user_id in new], ignore_conflicts=True
+        )
+        # Recounted in one statement, a concurrent follow may have inserted some of the rows
+        _recount([follower.pk, *new])
+        User.objects.filter(pk=follower.pk).update(follows_version=F('follows_version') + 1)
+        timeline.backfill_many(follower, new)
+        _followed_changed(follower, new)
+    return len(new)
+
+
+def _tags_by_user(user_ids):
+    tags = defaultdict(set)
+    rows = Post.tags.through.objects.filter(post__user__in=user_ids).values_list('post__user', 'tag').distinct()
+    for user_id, tag_id in rows:
+        tags[user_id].add(tag_id)
+    return tags
+
+
+def refresh_suggestions(user_ids):
+    """Recompute the suggestions of a batch of users, in a fixed number of queries whatever its size."""
+    user_ids = list(user_ids)
+    followed = defaultdict(set)
+    for follower_id, followed_id in Subscription.objects.filter(follower__in=user_ids).values_list(
+            'follower', 'followed'):
+        followed[follower_id].add(followed_id)
+
+    # (user, candidate) -> number of users followed by `user` who follow `candidate`
+    mutual = Subscription.objects.filter(follower__followers__follower__in=user_ids).values_list(
+        'follower__followers__follower', 'followed'
+    ).annotate(mutual_count=Count('id')).order_by()
+    candidates = defaultdict(dict)
+    for user_id, candidate_id, mutual_count in mutual:
+        if candidate_id != user_id and candidate_id not in followed[user_id]:
+            candidates[user_id][candidate_id] = mutual_count
+
+    tags = _tags_by_user(set(user_ids).union(*(c.keys() for c in candidates.values())))
+    suggestions = []
+    for user_id, scored in candidates.items():
+        ranked = []
+        for candidate_id, mutual_count in scored.items():
+            shared_tags_count = len(tags[user_id] & tags[candidate_id])
+            score = mutual_count + settings.SUGGESTIONS_TAG_WEIGHT * shared_tags_count
+            ranked.append(FollowSuggestion(user_id=user_id, candidate_id=candidate_id, mutual_count=mutual_count,
+                                           shared_tags_count=shared_tags_count, score=score))
+        ranked.sort(key=lambda suggestion: suggestion.score, reverse=True)
+        suggestions.extend(ranked[:settings.SUGGESTIONS_PER_USER])
+
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user__in=user_ids).delete()
+        FollowSuggestion.objects.bulk_create(suggestions)
+    return len(suggestions)
+
+
+def _refresh_followers_suggestions(user_id, followed_ids):
+    """
+    Rescore `followed_ids` as candidates of the most recent followers of `user_id`, at most
+    SUGGESTIONS_REFRESH_LIMIT of them: `user_id` is one of their friends and just followed or unfollowed them.
+    Every other candidate of those followers is unaffected and stays as stored.
+    """
+    followers = list(Subscription.objects.filter(followed=user_id).order_by('-created_at', '-id').values_list(
+        'follower', flat=True)[:settings.SUGGESTIONS_REFRESH_LIMIT])
+    if not followers:
+        return 0
+    followed_ids = list(followed_ids)
+    already = set(Subscription.objects.filter(follower__in=followers, followed__in=followed_ids).values_list(
+        'follower', 'followed'))
+    mutual = Subscription.objects.filter(follower__followers__follower__in=followers, followed__in=followed_ids)\
+        .values_list('follower__followers__follower', 'followed').annotate(mutual_count=Count('id')).order_by()
+
+    tags = _tags_by_user({*followers, *followed_ids})
+    suggestions = []
+    for user, candidate, mutual_count in mutual:
+        if user != candidate and (user, candidate) not in already:
+            shared_tags_count = len(tags[user] & tags[candidate])
+            suggestions.append(FollowSuggestion(
+                user_id=user, candidate_id=candidate, mutual_count=mutual_count, shared_tags_count=shared_tags_count,
+                score=mutual_count + settings.SUGGESTIONS_TAG_WEIGHT * shared_tags_count,
+            ))
+
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user__in=followers, candidate__in=followed_ids).delete()
+        FollowSuggestion.objects.bulk_create(suggestions)
+        # Keep the top SUGGESTIONS_PER_USER of each follower
+        ranked = FollowSuggestion.objects.filter(user__in=followers).annotate(rank=Window(
+            RowNumber(), partition_by=F('user'), order_by=[F('score').desc(), F('candidate')]
+        ))
+        beyond = [pk for pk, rank in ranked.values_list('pk', 'rank') if rank > settings.SUGGESTIONS_PER_USER]
+        FollowSuggestion.objects.filter(pk__in=beyond).delete()
+    return len(suggestions)
+
+
+def _refresh_after_follow_change(follower_id, followed_ids):
+    with _queued_lock:
+        _queued.discard((follower_id, followed_ids))
+    refresh_suggestions([follower_id])
+    _refresh_followers_suggestions(follower_id, followed_ids)
+
+
+# Follow changes queued for a suggestion refresh and not started yet
+_queued = set()
+_queued_lock = threading.Lock()
+
+
+def _queue_refresh(follower_id, followed_ids):
+    with _queued_lock:
+        if (follower_id, followed_ids) in _queued:
+            return
+        _queued.add((follower_id, followed_ids))
+    enqueue(_refresh_after_follow_change, follower_id, followed_ids)
+
+
+def refresh_suggestions_later(follower, followed_ids):
+    """
+    Queue the suggestion updates a follow change of `follower` makes: their own suggestions, and the rows of
+    `followed_ids` among their followers' suggestions. A change already queued is not queued again, repeated
+    toggles of one follow while it waits cost one refresh, which reads the graph as it is when it runs.
+    """
+    key = frozenset(followed_ids)
+    transaction.on_commit(lambda: _queue_refresh(follower.pk, key))
+
+
+def suggestions_for(user, limit=None):
+    return FollowSuggestion.objects.filter(user=user).select_related('candidate').order_by('-score')[
+        :limit or settings.SUGGESTIONS_PER_USER]
@@ -0,0 +1,212 @@
+"""
+Image storage and renditions of post and profile pictures.
+
+Uploads are stored untouched under their content hash as an ImageBlob, shared by every Post and User with the
+same bytes, and the request returns immediately; the renditions are generated once per blob by a background
+task (see `tasks.enqueue`) which copies them onto the blob's users and flips their `image_status`.
+Tasks die with their process: a blob left pending or processing for IMAGE_PROCESSING_TIMEOUT is queued again
+by the next upload of the same bytes or by the requeue_images command.
+"""
+import hashlib
+import logging
+import os
+from datetime import timedelta
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import fragments
+from .models import ImageBlob, ImageStatus, Post, User
+from .tasks import enqueue
+
+logger = logging.getLogger(__name__)
+
+# Rendition widths in pixels, the feed cards and the detail page pick from them through srcset
+POST_WIDTHS = (320, 480, 640, 800, 1080)
+USER_WIDTHS = (64, 128, 200, 400)
+QUALITY = {'jpeg': 85, 'webp': 80, 'avif': 60}
+
+# Modern formats are produced only when the installed Pillow can encode them
+Image.init()
+FORMATS = {name: pil_format for name, pil_format in (('avif', 'AVIF'), ('webp', 'WEBP'), ('jpeg', 'JPEG'))
+           if pil_format in Image.SAVE}
+EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp', 'avif': 'avif'}
+
+
+def render_renditions(storage, name, widths):
+    """
+    Resize a stored image to every width in `widths` (never upscaling) and encode each size in every
+    supported format, saving the results next to the original. Returns {format: [rendition, ...]}.
+
+    Memory stays bounded by the largest rendition rather than the upload: JPEGs are decoded straight
+    at a reduced scale through `Image.draft`, and encoded output is spooled to disk before storage.
+    """
+    prefix, _ = os.path.splitext(name)
+    largest = max(widths)
+
+    with storage.open(name, 'rb') as f:
+        img = Image.open(f)
+        # Square box: the image may still be rotated by its EXIF orientation
+        img.draft('RGB', (largest, largest))
+        img.load()
+        ImageOps.exif_transpose(img, in_place=True)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+    renditions = {format_name: [] for format_name in FORMATS}
+    # Largest first so every step downsamples the previous, smaller result
+    for width in sorted({min(width, img.width) for width in widths}, reverse=True):
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+        for format_name, pil_format in FORMATS.items():
+            with SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as output:
+                img.save(output, format=pil_format, quality=QUALITY[format_name])
+                output.seek(0)
+                stored_name = storage.save(f'{prefix}_{width}w.{EXTENSIONS[format_name]}', File(output))
+            renditions[format_name].insert(0, {'name': stored_name, 'width': img.width, 'height': img.height})
+    return renditions
+
+
+def delete_renditions(storage, renditions):
+    for variants in renditions.values():
+        for rendition in variants:
+            storage.delete(rendition['name'])
+
+
+def content_digest(upload):
+    """SHA-256 of the uploaded bytes, read chunk by chunk from the temporary upload file."""
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _discard_duplicate(blob):
+    """
+    Delete the file of a blob another request stored first. Both saved under the same name, and storages that
+    overwrite (GCS) left one object for both: then it is the winner's file and stays.
+    """
+    stored = ImageBlob.objects.filter(digest=blob.digest).values_list('image', flat=True).first()
+    if blob.image.name != stored:
+        blob.image.delete(save=False)
+
+
+def _acquire_blob(upload, widths):
+    """The blob holding these bytes with its ref_count already taken for the caller, storing it if new."""
+    digest = content_digest(upload)
+    while True:
+        blob = ImageBlob.objects.filter(digest=digest).first()
+        if blob is None:
+            _, extension = os.path.splitext(upload.name)
+            blob = ImageBlob(digest=digest)
+            blob.image.save(f'{digest[:2]}/{digest}{extension.lower()}', upload, save=False)
+            try:
+                with transaction.atomic():
+                    blob.save()
+            except IntegrityError:
+                _discard_duplicate(blob)
+                continue
+            enqueue(process_blob, blob.pk, widths)
+        elif blob.status != ImageStatus.READY:
+            _requeue(blob, widths)
+
+        # Zero rows when the last reference was released and the blob deleted in the meantime
+        if ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1):
+            return blob
+
+
+def _retryable():
+    """Blobs whose renditions failed, or whose task was lost: pending or processing for too long."""
+    lost_before = timezone.now() - timedelta(seconds=settings.IMAGE_PROCESSING_TIMEOUT)
+    return ImageBlob.objects.filter(
+        Q(status=ImageStatus.FAILED)
+        | Q(status__in=[ImageStatus.PENDING, ImageStatus.PROCESSING], status_changed_at__lt=lost_before)
+    )
+
+
+def _requeue(blob, widths):
+    """Queue the renditions of a retryable blob again, unless a concurrent request already did."""
+    if _retryable().filter(pk=blob.pk, status=blob.status).update(status=ImageStatus.PENDING,
+                                                                     status_changed_at=timezone.now()):
+        blob.status = ImageStatus.PENDING
+        enqueue(process_blob, blob.pk, widths)
+        return True
+    return False
+
+
+def requeue_lost_blobs():
+    """Queue again every blob whose task was lost, returns how many were."""
+    lost = _retryable().exclude(status=ImageStatus.FAILED).annotate(is_post=Exists(
+        Post.objects.filter(image_blob=OuterRef('pk'))
+    ))
+    return sum(_requeue(blob, POST_WIDTHS if blob.is_post else USER_WIDTHS) for blob in lost.iterator())
+
+
+def release_blob(blob_id, references=1):
+    """Drop references to a blob, deleting its files once nothing uses it anymore."""
+    if blob_id is None:
+        return
+    ImageBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=Greatest(F('ref_count') - references, 0))
+    blob = ImageBlob.objects.filter(pk=blob_id, ref_count=0).first()
+    # Conditional delete: a concurrent upload of the same bytes may have taken a new reference
+    if blob is not None and ImageBlob.objects.filter(pk=blob_id, ref_count=0).delete()[0]:
+        transaction.on_commit(lambda: _delete_blob_files(blob))
+
+
+def _delete_blob_files(blob):
+    blob.image.storage.delete(blob.image.name)
+    delete_renditions(blob.image.storage, blob.renditions)
+
+
+def process_blob(blob_id, widths):
+    blob = ImageBlob.objects.filter(pk=blob_id).first()
+    if blob is None:
+        return
+    ImageBlob.objects.filter(pk=blob_id).update(status=ImageStatus.PROCESSING, status_changed_at=timezone.now())
+
+    try:
+        renditions = render_renditions(blob.image.storage, blob.image.name, widths)
+    except Exception:
+        logger.exception('Generating renditions of image %s failed', blob.digest)
+        status = ImageStatus.FAILED
+        renditions = {}
+    else:
+        status = ImageStatus.READY
+
+    with transaction.atomic():
+        if not ImageBlob.objects.filter(pk=blob_id).update(renditions=renditions, status=status,
+                                                           status_changed_at=timezone.now()):
+            # Released while we were working
+            delete_renditions(blob.image.storage, renditions)
+            return
+        # Copied onto every user of the blob so rendering a feed needs no join
+        fragments.touch(Post.objects.filter(image_blob_id=blob_id), renditions=renditions, image_status=status)
+        User.objects.filter(image_blob_id=blob_id).update(renditions=renditions, image_status=status)
+
+
+def attach_image(instance, upload):
+    """
+    Point a Post or User at the blob of an uploaded image, storing and processing the bytes only the first
+    time they are seen. Identical uploads share one stored original and one set of renditions.
+    """
+    model = instance._meta.model
+    previous_blob_id = model.objects.filter(pk=instance.pk).values_list('image_blob_id', flat=True).first()
+    blob = _acquire_blob(upload, POST_WIDTHS if model is Post else USER_WIDTHS)
+
+    instance.image_blob = blob
+    instance.image = blob.image.name
+    instance.renditions = blob.renditions
+    instance.image_status = blob.status
+    fields = ['image_blob', 'image', 'renditions', 'image_status']
+    instance.save(update_fields=[*fields, 'updated_at'] if model is Post else fields)
+
+    if previous_blob_id != blob.pk:
+        release_blob(previous_blob_id)
+    else:
+        # Re-uploading the same picture keeps a single reference
+        release_blob(blob.pk)
@@ -0,0 +1,126 @@
+"""
+Write-behind buffer of post likes, enabled by LIKE_WRITE_BEHIND.
+
+A like click only records the viewer's new like state in process memory and answers with the stored count
+plus the pending difference, an eventually consistent count. Every LIKE_BUFFER_INTERVAL seconds, or once
+LIKE_BUFFER_SIZE clicks are pending, the buffer is written in one transaction: one bulk insert, one delete and
+one recount of the touched posts, however many clicks hit the same hot post in between.
+
+Pending likes live in one worker process and are lost if it is killed; gunicorn.conf.py flushes them when a
+worker exits normally.
+"""
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import count_of, LikePost, Post
+from .tasks import enqueue
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (post id, user id) -> (liked in the database, liked now)
+        self._pending = {}
+        # post id -> likes_count difference the pending likes will make
+        self._deltas = defaultdict(int)
+        # The pending likes a running flush is writing
+        self._flushing = {}
+        self._timer = None
+
+    def toggle(self, post, user):
+        """Flip the user's like of a post, returns (liked, pending likes_count difference of the post)."""
+        key = (post.pk, user.pk)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None and key in self._flushing:
+                # The database is about to hold the flushed state, not what it holds now
+                liked = self._flushing[key][1]
+                entry = (liked, liked)
+        if entry is None:
+            stored = LikePost.objects.filter(post=post, user=user).exists()
+            entry = (stored, stored)
+
+        with self._lock:
+            stored, liked = self._pending.get(key, entry)
+            self._set(key, stored, not liked)
+            delta = self._deltas[post.pk]
+            if len(self._pending) >= settings.LIKE_BUFFER_SIZE:
+                self._schedule(0)
+            elif self._pending and self._timer is None:
+                self._schedule(settings.LIKE_BUFFER_INTERVAL)
+        return not liked, delta
+
+    def _set(self, key, stored, liked):
+        _, previous = self._pending.pop(key, (stored, stored))
+        self._deltas[key[0]] += liked - previous
+        if liked != stored:
+            self._pending[key] = (stored, liked)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, enqueue, (self.flush,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Write every pending like, returns how many were written. A failed batch goes back in the buffer."""
+        with self._lock:
+            pending, self._pending, self._deltas = self._pending, {}, defaultdict(int)
+            self._flushing = pending
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        created = [LikePost(post_id=post_id, user_id=user_id)
+                   for (post_id, user_id), (_, liked) in pending.items() if liked]
+        deleted = defaultdict(list)
+        for (post_id, user_id), (_, liked) in pending.items():
+            if not liked:
+                deleted[post_id].append(user_id)
+        post_ids = {post_id for post_id, _ in pending}
+
+        written = False
+        try:
+            with transaction.atomic():
+                # Conflicts are likes another worker already stored
+                LikePost.objects.bulk_create(created, ignore_conflicts=True)
+                if deleted:
+                    condition = Q()
+                    for post_id, user_ids in deleted.items():
+                        condition |= Q(post_id=post_id, user_id__in=user_ids)
+                    LikePost.objects.filter(condition).delete()
+                # Recounted rather than incremented, so concurrent flushes of other workers cannot drift it
+                Post.objects.filter(id__in=post_ids).update(likes_count=count_of(LikePost, 'post'))
+            written = True
+        except Exception:
+            logger.exception('Flushing %d buffered likes failed', len(pending))
+            raise
+        finally:
+            with self._lock:
+                self._flushing = {}
+                if not written:
+                    for key, (stored, liked) in pending.items():
+                        self._restore(key, stored, liked)
+                if self._pending and self._timer is None:
+                    self._schedule(settings.LIKE_BUFFER_INTERVAL)
+        return len(pending)
+
+    def _restore(self, key, stored, liked):
+        """Put back a like whose flush failed, keeping any click made since, which assumed it was written."""
+        _, now = self._pending.pop(key, (liked, liked))
+        self._deltas[key[0]] += liked - stored
+        if now != stored:
+            self._pending[key] = (stored, now)
+
+
+buffer = LikeBuffer()
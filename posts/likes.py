@@ -0,0 +1,22 @@
+from .models import Comment, LikeComment, LikePost, Post
+
+LIKE_MODELS = {
+    Post: (LikePost, 'post'),
+    Comment: (LikeComment, 'comment'),
+}
+
+
+def attach_liked_by_me(objects, viewer):
+    """
+    Set `liked_by_me` on a page of Posts or Comments from the viewer's likes among them, fetched with one IN
+    query whatever the page size. Returns the objects as a list.
+    """
+    objects = list(objects)
+    liked = set()
+    if objects and viewer.is_authenticated:
+        like_model, field = LIKE_MODELS[objects[0]._meta.model]
+        liked = set(like_model.objects.filter(user=viewer, **{f'{field}__in': objects})
+                    .values_list(f'{field}_id', flat=True))
+    for obj in objects:
+        obj.liked_by_me = obj.pk in liked
+    return objects
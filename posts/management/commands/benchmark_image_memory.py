@@ -0,0 +1,81 @@
+import multiprocessing
+import resource
+import tempfile
+import time
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from posts.images import POST_WIDTHS, render_renditions
+
+
+def in_memory_pipeline(storage, name):
+    """The request-thread pipeline renditions replaced: full decode, resize, encode into copied buffers."""
+    with storage.open(name, 'rb') as f:
+        img = Image.open(BytesIO(f.read()))
+        img = img.convert('RGB')
+    img.thumbnail((800, 800), Image.Resampling.LANCZOS)
+    img_io = BytesIO()
+    img.save(img_io, format='JPEG', quality=85)
+    storage.save('in_memory.jpg', ContentFile(img_io.getvalue()))
+
+
+def streaming_pipeline(storage, name):
+    render_renditions(storage, name, POST_WIDTHS)
+
+
+PIPELINES = {
+    'in-memory': in_memory_pipeline,
+    'streaming': streaming_pipeline,
+}
+
+
+def _measure(pipeline, location, name, results):
+    storage = FileSystemStorage(location=location)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    PIPELINES[pipeline](storage, name)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is in KiB on Linux
+    results.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline, elapsed))
+
+
+class Command(BaseCommand):
+    help = 'Measure the peak RSS one image upload adds while being processed, per pipeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=4000)
+        parser.add_argument('--height', type=int, default=3000)
+        parser.add_argument('--runs', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # A fresh forked process per run so ru_maxrss is the peak of that run alone
+        context = multiprocessing.get_context('fork')
+
+        with tempfile.TemporaryDirectory() as location:
+            storage = FileSystemStorage(location=location)
+            img = Image.effect_noise((options['width'], options['height']), 64).convert('RGB')
+            img_io = BytesIO()
+            img.save(img_io, format='JPEG', quality=90)
+            name = storage.save('upload.jpg', ContentFile(img_io.getvalue()))
+            del img, img_io
+
+            self.stdout.write(f"{options['width']}x{options['height']} JPEG, {storage.size(name) // 1024} KiB")
+            for pipeline in PIPELINES:
+                peaks, timings = [], []
+                for _ in range(options['runs']):
+                    results = context.Queue()
+                    process = context.Process(target=_measure, args=(pipeline, location, name, results))
+                    process.start()
+                    process.join()
+                    if process.exitcode:
+                        raise CommandError(f'{pipeline} run failed with exit code {process.exitcode}')
+                    peak, elapsed = results.get()
+                    peaks.append(peak)
+                    timings.append(elapsed)
+                self.stdout.write(
+                    f'{pipeline:>10}: peak RSS +{max(peaks) / 1024:.1f} MiB, {min(timings) * 1000:.0f} ms'
+                )
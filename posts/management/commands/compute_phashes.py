@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts import phash
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Compute the perceptual hash of post images stored before hashing was introduced'
+
+    def handle(self, *args, **options):
+        hashed = failed = 0
+        for post in Post.objects.filter(phash__isnull=True).exclude(image='').only('id', 'image').iterator():
+            try:
+                with post.image.open('rb') as f:
+                    fields = phash.hash_fields(phash.dhash(f))
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f'Post {post.id}: {e}')
+                continue
+            Post.objects.filter(id=post.id).update(**fields)
+            hashed += 1
+        self.stdout.write(f'{hashed} posts hashed, {failed} failed')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.graph import refresh_suggestions
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Recompute the follow suggestions of every user in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+        stored = 0
+        for start in range(0, len(user_ids), options['batch_size']):
+            stored += refresh_suggestions(user_ids[start:start + options['batch_size']])
+        self.stdout.write(f'{stored} suggestions for {len(user_ids)} users')
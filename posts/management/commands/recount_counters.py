@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from posts.models import count_of, Post, Comment, LikePost, LikeComment, Subscription, User
+
+
+class Command(BaseCommand):
+    help = 'Backfill denormalized like/comment/follow counters and fix rows that drifted from the real counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted rows, do not update them')
+
+    def handle(self, *args, **options):
+        self.reconcile(Post, {
+            'likes_count': count_of(LikePost, 'post'),
+            'comments_count': count_of(Comment, 'post'),
+        }, options['dry_run'])
+        self.reconcile(Comment, {
+            'likes_count': count_of(LikeComment, 'comment'),
+        }, options['dry_run'])
+        self.reconcile(User, {
+            'followers_count': count_of(Subscription, 'followed'),
+            'following_count': count_of(Subscription, 'follower'),
+        }, options['dry_run'])
+
+    def reconcile(self, model, counters, dry_run):
+        drift = Q()
+        for name in counters:
+            drift |= ~Q(**{name: F(f'actual_{name}')})
+        drifted = model.objects.annotate(
+            **{f'actual_{name}': expression for name, expression in counters.items()}
+        ).filter(drift).values('pk')
+
+        if dry_run:
+            fixed = drifted.count()
+        else:
+            fixed = model.objects.filter(pk__in=drifted).update(**counters)
+
+        action = 'drifted' if dry_run else 'reconciled'
+        self.stdout.write(f'{model._meta.verbose_name}: {fixed} rows {action}')
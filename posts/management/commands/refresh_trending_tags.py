@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from posts.discovery import refresh_trending
+
+
+class Command(BaseCommand):
+    help = 'Decay trending tag scores and count the posts tagged since the last run, meant to run from cron'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{refresh_trending()} tags with new posts')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from posts import images
+
+
+class Command(BaseCommand):
+    help = 'Queue the renditions of images again whose background task was lost, run after restarting workers'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{images.requeue_lost_blobs()} images requeued')
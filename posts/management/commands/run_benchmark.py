@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Time the main pages and toggles against the seeded benchmark dataset, optionally saving JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--only', nargs='+', help='Scenario names to run, all by default')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare medians against')
+
+    def handle(self, *args, **options):
+        try:
+            scenarios = benchmark.run(options['rounds'], options['warmup'], options['only'])
+        except LookupError as e:
+            raise CommandError(e)
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['scenarios']
+
+        for name, result in scenarios.items():
+            line = (f"{name:>15}: median {result['median_ms']:8.2f} ms, p95 {result['p95_ms']:8.2f} ms, "
+                    f"{result['queries']:3d} queries")
+            if name in baseline:
+                before = baseline[name]
+                change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+                line += f"  ({change:+.0f}% median, {result['queries'] - before['queries']:+d} queries)"
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({**benchmark.environment(), 'rounds': options['rounds'], 'scenarios': scenarios}, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import datagen
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with a synthetic dataset of bench_ users, posts, comments, likes and follows, '
+            'loaded with COPY on PostgreSQL')
+
+    def add_arguments(self, parser):
+        for name, default in datagen.VOLUMES.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=int, default=default)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=365, help='Spread the posts over this many past days')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--flush', action='store_true', help='Delete an existing benchmark dataset first')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            self.stdout.write(f'{datagen.flush()} benchmark rows deleted')
+        elif User.objects.filter(username__startswith=datagen.PREFIX).exists():
+            raise CommandError('A benchmark dataset already exists, pass --flush to replace it')
+
+        datagen.generate(
+            {name: options[name] for name in datagen.VOLUMES},
+            batch_size=options['batch_size'], days=options['days'], seed=options['seed'], log=self.stdout.write,
+        )
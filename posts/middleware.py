@@ -0,0 +1,183 @@
+"""
+Per-request instrumentation: SQL query count and time, template render time and cache hits.
+
+RequestMetricsMiddleware counts every query through `connection.execute_wrapper`, reports the totals to staff
+users in a `Server-Timing` header, logs requests over their REQUEST_BUDGETS and adds them to per URL name histograms
+served by `request_stats_view`. The histograms live in the worker process and start empty on every restart.
+
+Template time is measured for TemplateResponse views only, the rendering done inside views calling `render()`
+counts in their total and reports tpl;dur=0.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.utils.functional import empty
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    @property
+    def duration(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, duration):
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+
+
+def record_cache(hits, misses=0):
+    """Count cache lookups towards the current request, if any."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One bucket per bound plus one for everything above the last
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def as_dict(self):
+        labels = [f'le_{bound}' for bound in self.bounds] + ['inf']
+        return {'buckets': dict(zip(labels, self.counts)), 'sum': round(self.total, 1), 'max': round(self.max, 1)}
+
+
+class RequestStats:
+    """Request histograms per URL name: duration and DB time in milliseconds, and query count."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def add(self, url_name, metrics, duration, over_budget):
+        with self._lock:
+            view = self._views.get(url_name)
+            if view is None:
+                view = self._views[url_name] = {
+                    'count': 0,
+                    'over_budget': 0,
+                    'duration_ms': Histogram(settings.REQUEST_STATS_MS_BUCKETS),
+                    'db_ms': Histogram(settings.REQUEST_STATS_MS_BUCKETS),
+                    'queries': Histogram(settings.REQUEST_STATS_QUERY_BUCKETS),
+                }
+            view['count'] += 1
+            view['over_budget'] += over_budget
+            view['duration_ms'].add(duration * 1000)
+            view['db_ms'].add(metrics.db_time * 1000)
+            view['queries'].add(metrics.queries)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                url_name: {key: value.as_dict() if isinstance(value, Histogram) else value for key, value in view.items()}
+                for url_name, view in sorted(self._views.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+
+stats = RequestStats()
+
+
+def budget_for(url_name):
+    """REQUEST_BUDGETS of a URL name over the '*' defaults."""
+    budgets = settings.REQUEST_BUDGETS
+    return {**budgets.get('*', {}), **budgets.get(url_name, {})}
+
+
+def _loaded_staff(request):
+    """
+    Whether the request's user is staff, answered only when the view already loaded the user: loading it here
+    would cost a session and a user query outside the measured view.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or getattr(user, '_wrapped', None) is empty:
+        return False
+    return user.is_staff
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        duration = metrics.duration
+        # Timings tell outsiders how much work a request costs, only staff see them unless enabled for everyone
+        if settings.SERVER_TIMING_HEADER or _loaded_staff(request):
+            response['Server-Timing'] = metrics.server_timing(duration)
+
+        match = request.resolver_match
+        url_name = match.view_name if match else None
+        if url_name:
+            budget = budget_for(url_name)
+            over_budget = (metrics.queries > budget.get('queries', float('inf'))
+                           or duration * 1000 > budget.get('ms', float('inf')))
+            if over_budget:
+                logger.warning(
+                    'Request %s %s over budget: %d queries, %.1f ms (budget %s)',
+                    request.method, request.path, metrics.queries, duration * 1000, budget,
+                )
+            stats.add(url_name, metrics, duration, over_budget)
+        return response
+
+    def process_template_response(self, request, response):
+        metrics = _current.get()
+        if metrics is not None:
+            # The response is rendered right after the last of these hooks returns
+            start = time.perf_counter()
+
+            def rendered(response):
+                metrics.template_time += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(c=Count('pk')).values('c')
+    ), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    LikePost = apps.get_model('posts', 'LikePost')
+    LikeComment = apps.get_model('posts', 'LikeComment')
+
+    Post.objects.update(likes_count=_count(LikePost, 'post'), comments_count=_count(Comment, 'post'))
+    Comment.objects.update(likes_count=_count(LikeComment, 'comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_subscription'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:04
+
+from django.db import migrations, models
+
+
+def mark_existing_posts_ready(apps, schema_editor):
+    # Images uploaded before the pipeline were already resized in the request and are served as they are
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(image_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='image_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(mark_existing_posts_ready, migrations.RunPython.noop),
+    ]
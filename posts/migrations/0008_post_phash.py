@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_image_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='phash',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='phash_band_0',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='phash_band_1',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='phash_band_2',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='phash_band_3',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
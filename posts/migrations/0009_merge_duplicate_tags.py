@@ -0,0 +1,44 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:23
+
+from collections import defaultdict
+
+from django.db import migrations
+
+
+def _normalize(name):
+    # Frozen copy of posts.models.normalize_tag
+    return ' '.join(name.strip().lstrip('#').split()).lower()[:64]
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Tag = apps.get_model('posts', 'Tag')
+    PostTag = Post._meta.get_field('tags').remote_field.through
+
+    groups = defaultdict(list)
+    for tag in Tag.objects.order_by('id'):
+        groups[_normalize(tag.name)].append(tag)
+
+    # Tags with nothing left after normalization are dropped with their links
+    Tag.objects.filter(id__in=[tag.id for tag in groups.pop('', [])]).delete()
+
+    for name, (kept, *duplicates) in groups.items():
+        if duplicates:
+            duplicate_ids = [tag.id for tag in duplicates]
+            tagged = set(PostTag.objects.filter(tag=kept).values_list('post_id', flat=True))
+            moved = set(PostTag.objects.filter(tag_id__in=duplicate_ids).values_list('post_id', flat=True)) - tagged
+            PostTag.objects.bulk_create([PostTag(post_id=post_id, tag=kept) for post_id in moved])
+            Tag.objects.filter(id__in=duplicate_ids).delete()
+        if kept.name != name:
+            Tag.objects.filter(id=kept.id).update(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_post_phash'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_merge_duplicate_tags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+    ]
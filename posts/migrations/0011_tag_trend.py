@@ -0,0 +1,28 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_tag_name_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagTrend',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='posts.tag')),
+                ('score', models.FloatField(default=0)),
+                ('scored_at', models.DateTimeField()),
+                ('last_link_id', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'TagTrend',
+                'verbose_name_plural': 'TagTrend',
+                'indexes': [models.Index(fields=['-score'], name='tag_trend_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:26
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+from posts.operations import PostgresOnly
+
+
+def backfill_search_vectors(apps, schema_editor):
+    # Other databases search through the in-memory index, built on first use
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    apps.get_model('posts', 'Post').objects.update(search_vector=SearchVector('description', config='english'))
+    apps.get_model('posts', 'Comment').objects.update(search_vector=SearchVector('text', config='english'))
+    apps.get_model('posts', 'User').objects.update(search_vector=SearchVector('username', 'nickname', config='simple'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('posts', '0011_tag_trend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        PostgresOnly(migrations.AddIndex(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='comment_search_idx'),
+        )),
+        PostgresOnly(migrations.AddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='post_search_idx'),
+        )),
+        PostgresOnly(migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='user_search_idx'),
+        )),
+        migrations.RunPython(backfill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:31
+
+from django.db import migrations
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(c=Count('pk')).values('c')
+    ), 0)
+
+
+def deduplicate_likes(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    LikePost = apps.get_model('posts', 'LikePost')
+    LikeComment = apps.get_model('posts', 'LikeComment')
+
+    # The first like of every (target, user) pair is kept
+    for model, target in ((LikePost, 'post'), (LikeComment, 'comment')):
+        first = model.objects.order_by().values(target, 'user').annotate(first_id=Min('id')).values('first_id')
+        model.objects.exclude(id__in=first).delete()
+
+    Post.objects.update(likes_count=_count(LikePost, 'post'))
+    Comment.objects.update(likes_count=_count(LikeComment, 'comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_likes, migrations.RunPython.noop),
+    ]
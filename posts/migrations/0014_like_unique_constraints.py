@@ -0,0 +1,21 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_deduplicate_likes'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='likecomment',
+            constraint=models.UniqueConstraint(fields=('comment', 'user'), name='unique_comment_like'),
+        ),
+        migrations.AddConstraint(
+            model_name='likepost',
+            constraint=models.UniqueConstraint(fields=('post', 'user'), name='unique_post_like'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(c=Count('pk')).values('c')
+    ), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    User = apps.get_model('posts', 'User')
+    Subscription = apps.get_model('posts', 'Subscription')
+    User.objects.update(followers_count=_count(Subscription, 'followed'), following_count=_count(Subscription, 'follower'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_like_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
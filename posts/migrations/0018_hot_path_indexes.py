@@ -0,0 +1,33 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:42
+
+from django.db import migrations, models
+
+from posts.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('posts', '0017_comment_post_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='comment_user_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='likecomment',
+            index=models.Index(fields=['comment', '-created_at', '-id'], name='like_comment_recent_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='likepost',
+            index=models.Index(fields=['post', '-created_at', '-id'], name='like_post_recent_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='subscription',
+            index=models.Index(fields=['followed', '-created_at', '-id'], name='subscription_followed_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='follows_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from posts.operations import DropIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # DROP INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('posts', '0019_user_follows_version'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                DropIndexConcurrently('comment', 'posts_comment_post_id_e81436d7', ['post']),
+                DropIndexConcurrently('comment', 'posts_comment_user_id_ad949c47', ['user']),
+                DropIndexConcurrently('likecomment', 'posts_likecomment_comment_id_aaa0831f', ['comment']),
+                DropIndexConcurrently('likepost', 'posts_likepost_post_id_34e7393a', ['post']),
+                DropIndexConcurrently('subscription', 'posts_subscription_followed_id_2ce6bef0', ['followed']),
+                DropIndexConcurrently('subscription', 'posts_subscription_follower_id_70f975ac', ['follower']),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='comment',
+                    name='post',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='posts.post'),
+                ),
+                migrations.AlterField(
+                    model_name='comment',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AlterField(
+                    model_name='likecomment',
+                    name='comment',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='likes', to='posts.comment'),
+                ),
+                migrations.AlterField(
+                    model_name='likepost',
+                    name='post',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='likes', to='posts.post'),
+                ),
+                migrations.AlterField(
+                    model_name='subscription',
+                    name='followed',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='followers', to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AlterField(
+                    model_name='subscription',
+                    name='follower',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='following', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+    ]
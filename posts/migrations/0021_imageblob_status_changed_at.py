@@ -0,0 +1,19 @@
+# Generated by Django 5.0.4 on 2026-10-18 21:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_drop_covered_fk_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='status_changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,13 +1,62 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
 import uuid
 
 
+def count_of(model, field):
+    """Correlated COUNT(*) of `model` rows pointing at the outer row through `field`."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(c=Count('pk')).values('c')
+    ), 0)
+
+
+class ImageStatus(models.TextChoices):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+
+
+class ImageBlob(models.Model):
+    """An uploaded image stored once under its content hash and shared by every Post and User using it."""
+    digest = models.CharField(max_length=64, unique=True)
+    image = models.ImageField(upload_to='images')
+    status = models.CharField(max_length=16, choices=ImageStatus.choices, default=ImageStatus.PENDING)
+    # When `status` last changed, a blob pending or processing for too long lost its background task
+    status_changed_at = models.DateTimeField(default=timezone.now)
+    renditions = models.JSONField(default=dict, blank=True)
+    # Number of Posts and Users referencing the blob, files are deleted when it drops to zero
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.digest}'
+
+    class Meta:
+        verbose_name = 'ImageBlob'
+        verbose_name_plural = 'ImageBlob'
+
+
 class User(AbstractUser):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     image = models.ImageField(upload_to='users_image', null=True, blank=True)
+    image_blob = models.ForeignKey('ImageBlob', related_name='users', null=True, blank=True, on_delete=models.SET_NULL)
+    image_status = models.CharField(max_length=16, choices=ImageStatus.choices, default=ImageStatus.READY)
+    renditions = models.JSONField(default=dict, blank=True)
     biography = models.TextField(max_length=512, null=True, blank=True)
     nickname = models.CharField(max_length=64, null=True, blank=True)
+    fanout_on_read = models.BooleanField(default=False)
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+    # Bumped on every follow or unfollow by the user, versions their cached followed ids, see posts/graph.py
+    follows_version = models.IntegerField(default=0)
+    # Maintained on save by the PostgreSQL search backend, see posts/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
 
     groups = models.ManyToManyField(
         Group,
@@ -27,9 +76,33 @@ class User(AbstractUser):
         related_query_name="user",
     )
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            GinIndex(fields=['search_vector'], name='user_search_idx'),
+        ]
+
+
+def normalize_tag(name):
+    """Canonical form of a tag name: no leading '#', single spaces, lowercase."""
+    return ' '.join(name.strip().lstrip('#').split()).lower()[:64]
+
+
+class TagQuerySet(models.QuerySet):
+    def bulk_upsert(self, names):
+        """The tags with the given names, creating the missing ones, in two queries whatever their number."""
+        names = list(dict.fromkeys(filter(None, map(normalize_tag, names))))
+        if not names:
+            return []
+        # Conflicts are tags that already exist or were created concurrently, the fetch returns them either way
+        self.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+        tags = {tag.name: tag for tag in self.filter(name__in=names)}
+        return [tags[name] for name in names]
+
 
 class Tag(models.Model):
-    name = models.CharField(max_length=64)
+    name = models.CharField(max_length=64, unique=True)
+
+    objects = TagQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.name}'
@@ -40,9 +113,12 @@ class Tag(models.Model):
 
 
 class Comment(models.Model):
-    user = models.ForeignKey('User', on_delete=models.CASCADE)
-    post = models.ForeignKey('Post', related_name='comments', on_delete=models.CASCADE)
+    # Both are the leading column of an index in Meta
+    user = models.ForeignKey('User', db_index=False, on_delete=models.CASCADE)
+    post = models.ForeignKey('Post', related_name='comments', db_index=False, on_delete=models.CASCADE)
     text = models.TextField(max_length=512)
+    likes_count = models.IntegerField(default=0)
+    search_vector = SearchVectorField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -52,67 +128,179 @@ class Comment(models.Model):
     class Meta:
         verbose_name = 'Comment'
         verbose_name_plural = 'Comment'
+        indexes = [
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='comment_user_idx'),
+            GinIndex(fields=['search_vector'], name='comment_search_idx'),
+        ]
+
+
+class PostQuerySet(models.QuerySet):
+    def feed(self, viewer=None):
+        """Posts ready for rendering as feed cards: author and tags preloaded, plus the viewer's like state."""
+        queryset = self.select_related('user').prefetch_related('tags')
+        if viewer is not None and viewer.is_authenticated:
+            liked_by_me = Exists(LikePost.objects.filter(post=OuterRef('pk'), user=viewer))
+        else:
+            liked_by_me = Value(False)
+        return queryset.annotate(liked_by_me=liked_by_me).order_by('-created_at')
 
 
 class Post(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     user = models.ForeignKey(to=User, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='posts_images')
+    image_blob = models.ForeignKey('ImageBlob', related_name='posts', null=True, blank=True, on_delete=models.SET_NULL)
+    image_status = models.CharField(max_length=16, choices=ImageStatus.choices, default=ImageStatus.PENDING)
+    renditions = models.JSONField(default=dict, blank=True)
+    # 64-bit dHash of the image and its four 16-bit bands, see posts/phash.py
+    phash = models.BigIntegerField(null=True, blank=True, db_index=True)
+    phash_band_0 = models.IntegerField(null=True, blank=True, db_index=True)
+    phash_band_1 = models.IntegerField(null=True, blank=True, db_index=True)
+    phash_band_2 = models.IntegerField(null=True, blank=True, db_index=True)
+    phash_band_3 = models.IntegerField(null=True, blank=True, db_index=True)
     description = models.TextField(max_length=1024, blank=True, null=True)
+    likes_count = models.IntegerField(default=0)
+    comments_count = models.IntegerField(default=0)
+    search_vector = SearchVectorField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     tags = models.ManyToManyField(Tag, related_name='users', blank=True)
 
+    objects = PostQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.user.username} - {self.id}'
 
     class Meta:
         verbose_name = 'Post'
         verbose_name_plural = 'Post'
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_feed_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='post_user_feed_idx'),
+            GinIndex(fields=['search_vector'], name='post_search_idx'),
+        ]
+
+
+class ToggleQuerySet(models.QuerySet):
+    def toggle(self, **fields):
+        """
+        Delete the row matching `fields`, or create it when there was none. Returns (exists, changed): whether
+        the row exists afterwards and whether this call changed anything, False when a concurrent toggle
+        created the same row first and the unique constraint rejected ours.
+        """
+        if self.filter(**fields).delete()[0]:
+            return False, True
+        try:
+            with transaction.atomic():
+                self.create(**fields)
+        except IntegrityError:
+            return True, False
+        return True, True
 
 
 class LikePost(models.Model):
-    post = models.ForeignKey('Post', related_name='likes', on_delete=models.CASCADE)
+    # Lead column of unique_post_like and like_post_recent_idx
+    post = models.ForeignKey('Post', related_name='likes', db_index=False, on_delete=models.CASCADE)
     user = models.ForeignKey('User', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ToggleQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'LikePost'
         verbose_name_plural = 'LikePost'
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'user'], name='unique_post_like'),
+        ]
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='like_post_recent_idx'),
+        ]
 
 
 class LikeComment(models.Model):
-    comment = models.ForeignKey('Comment', related_name='likes', on_delete=models.CASCADE)
+    # Lead column of unique_comment_like and like_comment_recent_idx
+    comment = models.ForeignKey('Comment', related_name='likes', db_index=False, on_delete=models.CASCADE)
     user = models.ForeignKey('User', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ToggleQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'LikeComment'
         verbose_name_plural = 'LikeComment'
+        constraints = [
+            models.UniqueConstraint(fields=['comment', 'user'], name='unique_comment_like'),
+        ]
+        indexes = [
+            models.Index(fields=['comment', '-created_at', '-id'], name='like_comment_recent_idx'),
+        ]
 
 
 class Subscription(models.Model):
-    follower = models.ForeignKey('User', related_name='following', on_delete=models.CASCADE)
-    followed = models.ForeignKey('User', related_name='followers', on_delete=models.CASCADE)
+    # Lead columns of unique_together and subscription_followed_idx
+    follower = models.ForeignKey('User', related_name='following', db_index=False, on_delete=models.CASCADE)
+    followed = models.ForeignKey('User', related_name='followers', db_index=False, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ToggleQuerySet.as_manager()
+
     class Meta:
         unique_together = ('follower', 'followed')
+        indexes = [
+            models.Index(fields=['followed', '-created_at', '-id'], name='subscription_followed_idx'),
+        ]
 
-    @classmethod
-    def follow(cls, user: User):
-        if not cls.is_following(user):
-            Subscription.objects.create(follower=self, followed=user)
 
-    def unfollow(self, user: User):
-        if self.is_following(user):
-            Subscription.objects.filter(follower=self, followed=user).delete()
+class TimelineEntry(models.Model):
+    user = models.ForeignKey('User', related_name='timeline', on_delete=models.CASCADE)
+    post = models.ForeignKey('Post', related_name='timeline_entries', on_delete=models.CASCADE)
+    # Copy of post.created_at so a timeline page is a single index range scan
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'TimelineEntry'
+        verbose_name_plural = 'TimelineEntry'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_idx'),
+        ]
+
+
+class TagTrend(models.Model):
+    """Exponentially decayed number of recent posts of a tag, maintained by posts.discovery.refresh_trending."""
+    tag = models.OneToOneField('Tag', primary_key=True, related_name='trend', on_delete=models.CASCADE)
+    score = models.FloatField(default=0)
+    # Time the score is decayed to and the last Post.tags link counted into it
+    scored_at = models.DateTimeField()
+    last_link_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'TagTrend'
+        verbose_name_plural = 'TagTrend'
+        indexes = [
+            models.Index(fields=['-score'], name='tag_trend_score_idx'),
+        ]
 
-    def is_following(self, user: User):
-        return Subscription.objects.filter(follower=self, followed=user).exists()
 
-    def followers(self):
-        return User.objects.filter(following__followed=self)
+class FollowSuggestion(models.Model):
+    """A user `user` may want to follow, precomputed by posts.graph.refresh_suggestions."""
+    user = models.ForeignKey('User', related_name='suggestions', on_delete=models.CASCADE)
+    candidate = models.ForeignKey('User', related_name='+', on_delete=models.CASCADE)
+    # Followed users of `user` who follow the candidate
+    mutual_count = models.IntegerField()
+    shared_tags_count = models.IntegerField()
+    score = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
 
-    def following(self):
-        return User.objects.filter(followers__follower=self)
+    class Meta:
+        verbose_name = 'FollowSuggestion'
+        verbose_name_plural = 'FollowSuggestion'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'candidate'], name='unique_follow_suggestion'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'], name='follow_suggestion_user_idx'),
+        ]
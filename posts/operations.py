@@ -0,0 +1,80 @@
+from django.contrib.postgres.operations import AddIndexConcurrently as PostgresAddIndexConcurrently
+from django.db import models
+from django.db.migrations.operations import AddIndex
+from django.db.migrations.operations.base import Operation
+
+
+class PostgresOnly(Operation):
+    """Runs the SQL of the wrapped migration operation on PostgreSQL only, its state change applies everywhere."""
+    reversible = True
+
+    def __init__(self, operation):
+        self.operation = operation
+
+    def deconstruct(self):
+        return self.__class__.__qualname__, [self.operation], {}
+
+    def state_forwards(self, app_label, state):
+        self.operation.state_forwards(app_label, state)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            self.operation.database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            self.operation.database_backwards(app_label, schema_editor, from_state, to_state)
+
+    def describe(self):
+        return f'{self.operation.describe()} (PostgreSQL only)'
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+    """
+    AddIndex building the index with CREATE INDEX CONCURRENTLY on PostgreSQL, so writes to a large table go on
+    while it is built, and a plain AddIndex elsewhere. The migration must set `atomic = False`.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class DropIndexConcurrently(Operation):
+    """
+    Drops the index `name` on `fields` of a model, with DROP INDEX CONCURRENTLY on PostgreSQL so writes to a large
+    table go on meanwhile. Database only: pair it with its state change in SeparateDatabaseAndState, such as the
+    AlterField setting db_index=False on the field Django indexed. The migration must set `atomic = False`.
+    """
+    reversible = True
+
+    def __init__(self, model_name, name, fields):
+        self.model_name = model_name
+        self.name = name
+        self.fields = fields
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        concurrently = ' CONCURRENTLY' if schema_editor.connection.vendor == 'postgresql' else ''
+        schema_editor.execute(f'DROP INDEX{concurrently} IF EXISTS {schema_editor.quote_name(self.name)}')
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        index = models.Index(fields=self.fields, name=self.name)
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+    def describe(self):
+        return f'Drop index {self.name} on {self.model_name}'
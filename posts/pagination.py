@@ -0,0 +1,120 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import BadRequest, FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+
+from .phash import collapse_near_duplicates
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class CursorPaginator:
+    """
+    Keyset paginator: every page is `WHERE (ordering) < (last row) ORDER BY ordering LIMIT n`,
+    so page 500 costs the same index range scan as page 1 and nothing is ever counted.
+
+    `ordering` must end with a unique field and all fields must share one direction.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.descending = ordering[0].startswith('-')
+        self.fields = [name.lstrip('-') for name in ordering]
+
+    def after(self, cursor=None):
+        """The ordered queryset of everything following `cursor`."""
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode(cursor)))
+        return queryset
+
+    def page(self, cursor=None):
+        objects = list(self.after(cursor)[:self.per_page + 1])
+        next_cursor = None
+        if len(objects) > self.per_page:
+            objects = objects[:self.per_page]
+            next_cursor = self.encode(objects[-1])
+        return CursorPage(objects, next_cursor)
+
+    def encode(self, obj):
+        values = [self._value(obj, name) for name in self.fields]
+        payload = json.dumps(values, default=str, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [self._to_python(name, value) for name, value in zip(self.fields, values)]
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            raise BadRequest('Invalid cursor')
+
+    def _after(self, values):
+        lookup = 'lt' if self.descending else 'gt'
+        condition = Q()
+        for i, name in enumerate(self.fields):
+            equal = {field: value for field, value in zip(self.fields[:i], values[:i])}
+            condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+        return condition
+
+    def _field(self, name):
+        try:
+            return self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # An annotation such as a search rank, its JSON value is used as is
+            return None
+
+    def _value(self, obj, name):
+        if isinstance(obj, dict):
+            return obj[name]
+        field = self._field(name)
+        return getattr(obj, field.attname if field else name)
+
+    def _to_python(self, name, value):
+        field = self._field(name)
+        return field.to_python(value) if field else value
+
+
+class CursorPaginationMixin:
+    """ListView mixin replacing OFFSET paging with `?cursor=` keyset pages; `?format=json` returns the rendered items."""
+    paginate_by = 10
+    paginator_class = CursorPaginator
+    cursor_ordering = ('-created_at', '-id')
+    items_template_name = None
+    # Hide reposts of a picture already on the page, the cursor still points past them
+    collapse_near_duplicates = False
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.paginator_class(queryset, page_size, self.cursor_ordering)
+        page = paginator.page(self.request.GET.get('cursor'))
+        if self.collapse_near_duplicates:
+            page.object_list = collapse_near_duplicates(page.object_list)
+        return paginator, page, page.object_list, page.has_next
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get('format') != 'json' or not self.items_template_name:
+            return super().render_to_response(context, **response_kwargs)
+
+        html = render_to_string(self.items_template_name, context, self.request)
+        return JsonResponse({'html': html, 'next_cursor': context['page_obj'].next_cursor})
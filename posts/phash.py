@@ -0,0 +1,104 @@
+"""
+Perceptual hashes for near-duplicate image detection.
+
+Every post image gets a 64-bit difference hash (dHash): re-encoded, resized or slightly edited copies of a
+picture land within a few bits of each other. The hash is also stored as four 16-bit bands in indexed columns
+(multi-index hashing): two hashes at most `d` bits apart have at least one band at most `d // 4` bits apart,
+so a lookup is a handful of indexed equality matches instead of a comparison against every stored image.
+"""
+from itertools import combinations
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from PIL import Image
+
+BANDS = 4
+BAND_BITS = 16
+# Flat or low-texture images hash to (almost) all zeros or ones and would all match each other
+MIN_SET_BITS = 8
+MAX_SET_BITS = 64 - MIN_SET_BITS
+
+
+def dhash(file):
+    """dHash of an image file: one bit per horizontally adjacent pixel pair of a 9x8 grayscale thumbnail."""
+    with Image.open(file) as img:
+        # Decoding a JPEG at 1/8 scale is plenty for a 9x8 thumbnail
+        img.draft('L', (64, 64))
+        pixels = np.asarray(img.convert('L').resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def bands(value):
+    return [(value >> (BAND_BITS * i)) & ((1 << BAND_BITS) - 1) for i in range(BANDS)]
+
+
+def to_signed(value):
+    """Store the unsigned 64-bit hash in a signed BIGINT column."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value & ((1 << 64) - 1)
+
+
+def hash_fields(value):
+    """Post field values for a hash."""
+    return {'phash': to_signed(value), **{f'phash_band_{i}': band for i, band in enumerate(bands(value))}}
+
+
+def hamming(a, b):
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count('1')
+
+
+def distinctive(value):
+    """Whether a hash carries enough of the picture to be compared with others."""
+    return value is not None and MIN_SET_BITS <= bin(to_unsigned(value)).count('1') <= MAX_SET_BITS
+
+
+def _neighbours(band, radius):
+    """Every 16-bit value within `radius` flipped bits of `band`."""
+    values = [band]
+    for distance in range(1, radius + 1):
+        for positions in combinations(range(BAND_BITS), distance):
+            flipped = band
+            for position in positions:
+                flipped ^= 1 << position
+            values.append(flipped)
+    return values
+
+
+def near_duplicates(queryset, value, max_distance=None):
+    """
+    Objects of `queryset` whose hash is within `max_distance` bits of `value`, as (distance, object) pairs.
+    Empty for a hash that is not distinctive.
+    """
+    if not distinctive(value):
+        return []
+    if max_distance is None:
+        max_distance = settings.PHASH_MAX_DISTANCE
+    radius = max_distance // BANDS
+    candidates = Q()
+    for i, band in enumerate(bands(value)):
+        candidates |= Q(**{f'phash_band_{i}__in': _neighbours(band, radius)})
+
+    matches = []
+    for obj in queryset.filter(candidates):
+        distance = hamming(obj.phash, value)
+        if distance <= max_distance:
+            matches.append((distance, obj))
+    return sorted(matches, key=lambda match: match[0])
+
+
+def collapse_near_duplicates(posts, max_distance=None):
+    """Keep only the first of the posts on a page that show the same picture."""
+    if max_distance is None:
+        max_distance = settings.PHASH_MAX_DISTANCE
+    kept = []
+    for post in posts:
+        if not distinctive(post.phash) or all(
+            not distinctive(other.phash) or hamming(post.phash, other.phash) > max_distance for other in kept
+        ):
+            kept.append(post)
+    return kept
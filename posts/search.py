@@ -0,0 +1,193 @@
+"""
+Full-text search over posts, by description and comments, and over users, by username and nickname.
+
+Both backends turn a query into querysets annotated with a `rank`, paginated like any feed.
+PostgresSearchBackend matches tsvector columns served by GIN indexes; the signals in posts/signals.py
+recompute a row's vector in the database whenever it is saved, so no query computes a tsvector.
+InvertedIndexBackend answers from a pure-Python inverted index held in process memory, for SQLite in
+development and tests.
+"""
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+
+from .models import Comment, Post, User
+
+# A match in a comment counts for half a match in the description
+COMMENT_WEIGHT = 0.5
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class PostgresSearchBackend:
+    config = 'english'
+    # Names are not stemmed
+    user_config = 'simple'
+
+    def vector(self, model):
+        if model is Post:
+            return SearchVector('description', config=self.config)
+        if model is Comment:
+            return SearchVector('text', config=self.config)
+        return SearchVector('username', 'nickname', config=self.user_config)
+
+    def update(self, instance):
+        model = instance._meta.model
+        model.objects.filter(pk=instance.pk).update(search_vector=self.vector(model))
+
+    def remove(self, instance):
+        pass
+
+    def posts(self, text):
+        query = SearchQuery(text, config=self.config, search_type='websearch')
+        comments = Comment.objects.filter(search_vector=query)
+        comment_rank = comments.filter(post=OuterRef('pk')).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank').values('rank')[:1]
+
+        return Post.objects.filter(Q(search_vector=query) | Q(id__in=comments.values('post_id'))).annotate(
+            rank=Coalesce(SearchRank(F('search_vector'), query), 0.0)
+            + COMMENT_WEIGHT * Coalesce(Subquery(comment_rank, output_field=FloatField()), 0.0)
+        )
+
+    def users(self, text):
+        tokens = tokenize(text)
+        if not tokens:
+            return User.objects.none().annotate(rank=Value(0.0))
+        # Every word as a prefix, so a partially typed username matches
+        query = SearchQuery(' & '.join(f'{token}:*' for token in tokens), config=self.user_config, search_type='raw')
+        return User.objects.filter(search_vector=query).annotate(rank=SearchRank(F('search_vector'), query))
+
+
+class InvertedIndex:
+    """Token -> {document key: term frequency}, scored with tf-idf."""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+
+    def add(self, key, text):
+        self.remove(key)
+        self.documents[key] = counts = Counter(tokenize(text))
+        for token, count in counts.items():
+            self.postings[token][key] = count
+
+    def remove(self, key):
+        for token in self.documents.pop(key, ()):
+            self.postings[token].pop(key, None)
+            if not self.postings[token]:
+                del self.postings[token]
+
+    def search(self, text, prefix=False):
+        """{key: score} of the documents containing every token of `text`, or a word starting with it."""
+        scores = None
+        for token in set(tokenize(text)):
+            if prefix:
+                matched = Counter()
+                for word in [word for word in self.postings if word.startswith(token)]:
+                    matched |= Counter(self.postings[word])
+            else:
+                matched = self.postings.get(token, {})
+            idf = math.log(1 + len(self.documents) / (1 + len(matched)))
+            token_scores = {key: (1 + math.log(count)) * idf for key, count in matched.items()}
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {key: scores[key] + token_scores[key] for key in scores.keys() & token_scores.keys()}
+        return scores or {}
+
+
+class InvertedIndexBackend:
+    _lock = threading.Lock()
+    _indexes = None
+    # Comment id -> post id
+    _comment_posts = {}
+
+    @classmethod
+    def _load(cls):
+        cls._comment_posts = {}
+        posts, comments, users = InvertedIndex(), InvertedIndex(), InvertedIndex()
+        for pk, description in Post.objects.values_list('pk', 'description'):
+            posts.add(pk, description)
+        for pk, post_id, text in Comment.objects.values_list('pk', 'post_id', 'text'):
+            comments.add(pk, text)
+            cls._comment_posts[pk] = post_id
+        for pk, username, nickname in User.objects.values_list('pk', 'username', 'nickname'):
+            users.add(pk, f'{username} {nickname or ""}')
+        cls._indexes = {Post: posts, Comment: comments, User: users}
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._indexes = None
+            cls._comment_posts = {}
+
+    def update(self, instance):
+        model = instance._meta.model
+        with self._lock:
+            # Not loaded yet, the instance will be read from the database with everything else
+            if self._indexes is None:
+                return
+            if model is Post:
+                text = instance.description
+            elif model is Comment:
+                text = instance.text
+                self._comment_posts[instance.pk] = instance.post_id
+            else:
+                text = f'{instance.username} {instance.nickname or ""}'
+            self._indexes[model].add(instance.pk, text)
+
+    def remove(self, instance):
+        with self._lock:
+            if self._indexes is not None:
+                self._indexes[instance._meta.model].remove(instance.pk)
+                if isinstance(instance, Comment):
+                    self._comment_posts.pop(instance.pk, None)
+
+    def _search(self, model, text):
+        with self._lock:
+            if self._indexes is None:
+                self._load()
+            if model is User:
+                return self._indexes[User].search(text, prefix=True)
+
+            ranks = self._indexes[Post].search(text)
+            comment_ranks = {}
+            for comment_id, rank in self._indexes[Comment].search(text).items():
+                post_id = self._comment_posts[comment_id]
+                comment_ranks[post_id] = max(rank, comment_ranks.get(post_id, 0))
+            for post_id, rank in comment_ranks.items():
+                ranks[post_id] = ranks.get(post_id, 0) + COMMENT_WEIGHT * rank
+            return ranks
+
+    @staticmethod
+    def _ranked(model, ranks):
+        if not ranks:
+            return model.objects.none().annotate(rank=Value(0.0))
+        return model.objects.filter(pk__in=ranks).annotate(rank=Case(
+            *[When(pk=pk, then=Value(rank)) for pk, rank in ranks.items()], output_field=FloatField()
+        ))
+
+    def posts(self, text):
+        return self._ranked(Post, self._search(Post, text))
+
+    def users(self, text):
+        return self._ranked(User, self._search(User, text))
+
+
+def get_backend():
+    path = settings.SEARCH_BACKEND
+    if path is None:
+        vendor_backends = {'postgresql': 'posts.search.PostgresSearchBackend'}
+        path = vendor_backends.get(connection.vendor, 'posts.search.InvertedIndexBackend')
+    return import_string(path)()
@@ -0,0 +1,50 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import fragments, search
+from .images import release_blob
+from .models import Comment, Post, User
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=User)
+def release_image_blob(sender, instance, **kwargs):
+    release_blob(instance.image_blob_id)
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_card_fragment(sender, instance, **kwargs):
+    fragments.invalidate(instance)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def touch_tagged_posts(sender, instance, action, reverse, pk_set, **kwargs):
+    """Tags are part of the card but changing them does not save the post, move it to a new card version."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            fragments.touch(Post.objects.filter(pk=instance.pk))
+    elif action in ('post_add', 'post_remove'):
+        fragments.touch(Post.objects.filter(pk__in=pk_set))
+    elif action == 'pre_clear':
+        # Once cleared the tag no longer knows its posts
+        fragments.touch(Post.objects.filter(pk__in=list(instance.users.values_list('pk', flat=True))))
+
+
+SEARCHED_FIELDS = {Post: {'description'}, Comment: {'text'}, User: {'username', 'nickname'}}
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=User)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login only
+    if update_fields is not None and not SEARCHED_FIELDS[sender] & set(update_fields):
+        return
+    search.get_backend().update(instance)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=User)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.get_backend().remove(instance)
@@ -0,0 +1,44 @@
+"""
+In-process background queue: a small thread pool per web worker, no external broker needed.
+
+Tasks are submitted after the current transaction commits so they always see the rows they refer to.
+They must be idempotent and cheap to lose: work queued in a process that is killed is not retried.
+"""
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix='posts-task')
+            atexit.register(_executor.shutdown, wait=True)
+        return _executor
+
+
+def _run(func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Background task %s failed', func.__name__)
+    finally:
+        connections.close_all()
+
+
+def enqueue(func, *args):
+    """Run `func(*args)` in the background once the current transaction commits."""
+    if settings.BACKGROUND_TASKS_EAGER:
+        transaction.on_commit(lambda: func(*args))
+    else:
+        transaction.on_commit(lambda: _get_executor().submit(_run, func, args))
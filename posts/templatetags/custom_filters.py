@@ -1,7 +1,13 @@
 from django import template
+from django.forms.utils import flatatt
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
 from django.utils.timesince import timesince
 from django.utils.timezone import now
 
+from posts.fragments import attach_card_fragments
+from posts.models import ImageStatus
+
 register = template.Library()
 
 
@@ -25,3 +31,38 @@ def custom_timesince(value):
     else:
         return timesince(value)
 
+
+@register.simple_tag
+def responsive_image(instance, sizes='100vw', **attrs):
+    """
+    <picture> for a Post or User image: a srcset per available format so the browser downloads only the width
+    it needs, and intrinsic width/height so the layout doesn't shift. A placeholder while renditions are pending.
+    """
+    jpeg = instance.renditions.get('jpeg')
+    if not jpeg:
+        if instance.image and instance.image_status == ImageStatus.READY:
+            # Uploaded before renditions existed, already resized
+            return format_html('<img src="{}"{}>', instance.image.url, flatatt(attrs))
+        return format_html('<img src="{}" width="400" height="400"{}>', static('images/placeholder.png'), flatatt(attrs))
+
+    storage = instance.image.storage
+
+    def srcset(variants):
+        return ', '.join(f'{storage.url(variant["name"])} {variant["width"]}w' for variant in variants)
+
+    sources = format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', (
+        (mime_type, srcset(instance.renditions[name]), sizes)
+        for name, mime_type in (('avif', 'image/avif'), ('webp', 'image/webp'))
+        if instance.renditions.get(name)
+    ))
+    largest = jpeg[-1]
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" loading="lazy" decoding="async"{}></picture>',
+        sources, storage.url(largest['name']), srcset(jpeg), sizes, largest['width'], largest['height'], flatatt(attrs)
+    )
+
+
+@register.simple_tag
+def load_card_fragments(posts):
+    attach_card_fragments(posts)
+    return ''
@@ -1,10 +1,25 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
 
-from posts.models import User, Post, Tag, LikePost, Comment, Subscription
+from posts import benchmark, datagen, discovery, fragments, graph, images, like_buffer, middleware, phash, search, views
+from posts.models import ImageBlob, ImageStatus, User, Post, Tag, LikePost, Comment, LikeComment, Subscription, TimelineEntry, TagTrend, ToggleQuerySet
 
 import io
+import json
+import random
+import re
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
 from PIL import Image
 
 
@@ -194,5 +209,741 @@ class DjangogramTestCase(TestCase):
         self.assertJSONEqual(response.content, {'success': True, 'is_following': False})
         self.assertFalse(Subscription.objects.filter(follower=self.user, followed=user_2.id).exists())
 
+    def test_counters_follow_comments_and_recount(self):
+        self.client.login(username=self.username, password=self.password)
+        self.client.post(reverse('create_comment', kwargs={'post_id': self.post.id}), {'text': 'Counted'})
+        comment = Comment.objects.get(text='Counted')
+        self.client.get(reverse('like_comment', kwargs={'comment_id': comment.id}))
+
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(comment.likes_count, 1)
+
+        # Edits write only their own fields, not counters read before a concurrent update
+        with CaptureQueriesContext(connection) as captured:
+            self.client.post(reverse('update_comment', kwargs={'comment_id': comment.id}), {'text': 'Edited'})
+            self.client.post(reverse('edit_description', kwargs={'post_id': self.post.id}), {'description': 'Edited'})
+        updates = [q['sql'] for q in captured if q['sql'].startswith(('UPDATE "posts_comment"', 'UPDATE "posts_post"'))]
+        self.assertEqual(len(updates), 2)
+        self.assertFalse(any('likes_count' in sql or 'comments_count' in sql for sql in updates))
+
+        # A comment another request already deleted is not discounted again
+        with mock.patch.object(Comment, 'delete', return_value=(0, {})):
+            self.client.post(reverse('delete_comment', kwargs={'comment_id': comment.id}))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+        # Drift is fixed by the reconcile command
+        Post.objects.filter(id=self.post.id).update(likes_count=7, comments_count=0)
+        call_command('recount_counters', stdout=io.StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (0, 1))
+
+    def test_feed_query_count_does_not_depend_on_page_size(self):
+        self.client.login(username=self.username, password=self.password)
+        tag = Tag.objects.get(name='123')
+
+        def feed_queries():
+            queries = {}
+            for name, url in [
+                ('index', reverse('index')),
+                ('user', reverse('user_page', kwargs={'username': self.username})),
+                ('tag', reverse('tag_page', kwargs={'name': tag.name})),
+            ]:
+                cache.clear()
+                with CaptureQueriesContext(connection) as context:
+                    self.client.get(url)
+                queries[name] = len(context.captured_queries)
+            return queries
+
+        single_post = feed_queries()
+        for i in range(9):
+            post = Post.objects.create(description=f'Post {i}', user=self.user, image=self.post.image.name)
+            post.tags.add(tag)
+            LikePost.objects.create(post=post, user=self.user)
+        self.assertEqual(feed_queries(), single_post)
+
+    def test_feed_cursor_pagination(self):
+        self.client.login(username=self.username, password=self.password)
+        for i in range(24):
+            Post.objects.create(description=f'Post {i}', user=self.user, image=self.post.image.name)
+
+        seen = []
+        response = self.client.get(reverse('index'))
+        seen += [post.id for post in response.context['posts']]
+        cursor = response.context['page_obj'].next_cursor
+        while cursor:
+            response = self.client.get(reverse('index'), {'cursor': cursor, 'format': 'json'})
+            data = response.json()
+            seen += [post.id for post in response.context['posts']]
+            self.assertEqual(data['html'].count('card-header'), len(response.context['posts']))
+            cursor = data['next_cursor']
+
+        expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(reverse('index'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_following_timeline(self):
+        self.client.login(username=self.username, password=self.password)
+        author = User.objects.create(username='Author', email='author@gmal.ca')
+        celebrity = User.objects.create(username='Celebrity', email='celebrity@gmal.ca')
+        old_post = Post.objects.create(description='Before follow', user=author, image=self.post.image.name)
+
+        # Backfill on follow, fan-out on write for new posts, in the background
+        self.client.get(reverse('follow_user', args=[author.id]))
+        self.client.force_login(author)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post(reverse('create_post'), {
+                'description': 'Pushed', 'image': self._create_test_image(self), 'tags': 'timeline'
+            })
+        new_post = Post.objects.get(description='Pushed')
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 2)
+
+        # Authors over the fan-out limit are merged in on read
+        graph.toggle_follow(self.user, celebrity)
+        with override_settings(TIMELINE_FANOUT_LIMIT=0), self.captureOnCommitCallbacks(execute=True):
+            self.client.force_login(celebrity)
+            self.client.post(reverse('create_post'), {
+                'description': 'Pulled', 'image': self._create_test_image(self), 'tags': 'timeline'
+            })
+        pulled_post = Post.objects.get(description='Pulled')
+        self.assertFalse(TimelineEntry.objects.filter(post=pulled_post).exists())
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('following'))
+        self.assertEqual(
+            [post.id for post in response.context['posts']],
+            [pulled_post.id, new_post.id, old_post.id, self.post.id]
+        )
+
+        # Unfollow prunes the timeline
+        self.client.get(reverse('follow_user', args=[author.id]))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    def test_reactions_page_is_one_bounded_query(self):
+        self.client.login(username=self.username, password=self.password)
+        own_comment = Comment.objects.create(text='Own comment', user=self.user, post=self.post)
+
+        def add_reactions(n):
+            for i in range(n):
+                fan = User.objects.create(username=f'fan{User.objects.count()}')
+                Comment.objects.create(text=f'Nice {i}', user=fan, post=self.post)
+                LikePost.objects.create(post=self.post, user=fan)
+                LikeComment.objects.create(comment=own_comment, user=fan)
+                Subscription.objects.create(follower=fan, followed=self.user)
+
+        def reactions_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('reactions_page', kwargs={'username': self.username}))
+            return response, len(context.captured_queries)
+
+        add_reactions(1)
+        _, few = reactions_queries()
+        add_reactions(6)
+        response, many = reactions_queries()
+        self.assertEqual(few, many)
+
+        # Pages follow each other without gaps or repeats, newest first
+        seen = list(response.context['reactions'])
+        cursor = response.context['page_obj'].next_cursor
+        while cursor:
+            response = self.client.get(reverse('reactions_page', kwargs={'username': self.username}), {'cursor': cursor})
+            seen += list(response.context['reactions'])
+            cursor = response.context['page_obj'].next_cursor
+        self.assertEqual(len(seen), 7 * 4 + 1)
+        self.assertEqual(len({(r['kind'], r['id']) for r in seen}), len(seen))
+        self.assertEqual(seen, sorted(seen, key=lambda r: (r['created_at'], r['kind'], r['id']), reverse=True))
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_image_renditions_are_generated_after_upload(self):
+        self.client.login(username=self.username, password=self.password)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post(reverse('create_post'), {
+                'description': 'Renditions', 'image': self._create_test_image(self), 'tags': 'tag1'
+            })
+        post = Post.objects.get(description='Renditions')
+        self.assertEqual(post.image_status, ImageStatus.PENDING)
+        self.assertIn('placeholder', self.client.get(reverse('index')).content.decode())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+        post.refresh_from_db()
+        self.assertEqual(post.image_status, ImageStatus.READY)
+        # The 100px test image is never upscaled, so every format has a single rendition
+        self.assertIn('jpeg', post.renditions)
+        self.assertEqual([r['width'] for r in post.renditions['jpeg']], [100])
+        content = self.client.get(reverse('index')).content.decode()
+        self.assertIn(f"{post.renditions['jpeg'][0]['name']} 100w", content)
+        self.assertIn('width="100" height="100"', content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('settings', kwargs={'username': self.username}), {
+                'username': self.username, 'first_name': '', 'last_name': '', 'biography': '',
+                'email': 'username333@gmal.ca', 'image': self._create_test_image(self)
+            })
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.image_status, ImageStatus.READY)
+        self.assertEqual(self.user.renditions['jpeg'][-1]['width'], 100)
+
+        # A follow while the profile is edited is kept
+        stale = User.objects.get(pk=self.user.pk)
+        User.objects.filter(pk=self.user.pk).update(followers_count=F('followers_count') + 1,
+                                                    follows_version=F('follows_version') + 1)
+        with mock.patch.object(views.UserProfileUpdateView, 'get_object', return_value=stale):
+            self.client.post(reverse('settings', kwargs={'username': self.username}), {
+                'username': self.username, 'first_name': 'Edited', 'last_name': '', 'biography': '', 'email': '',
+            })
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.first_name, self.user.followers_count, self.user.follows_version),
+                         ('Edited', stale.followers_count + 1, stale.follows_version + 1))
+
+    def test_upload_limits(self):
+        self.client.login(username=self.username, password=self.password)
+        data = {'description': 'Too big', 'tags': 'tag1'}
+
+        with override_settings(IMAGE_UPLOAD_MAX_SIZE=100):
+            response = self.client.post(reverse('create_post'), {**data, 'image': self._create_test_image(self)})
+        self.assertTrue(response.context['form'].errors['image'])
+
+        with override_settings(IMAGE_MAX_PIXELS=99 * 99):
+            response = self.client.post(reverse('create_post'), {**data, 'image': self._create_test_image(self)})
+        self.assertEqual(response.context['form'].errors['image'], ['Image resolution is too large.'])
+        self.assertFalse(Post.objects.filter(description='Too big').exists())
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_identical_uploads_share_one_blob(self):
+        other = User.objects.create_user(username='other', email='other@gmal.ca', password=self.password)
+        for user, description in ((self.user, 'First'), (other, 'Repost')):
+            self.client.force_login(user)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('create_post'), {
+                    'description': description, 'image': self._create_test_image(self), 'tags': 'tag1'
+                })
+        first, repost = Post.objects.get(description='First'), Post.objects.get(description='Repost')
+        blob = ImageBlob.objects.get()
+
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(first.image.name, repost.image.name)
+        self.assertEqual(repost.image_status, ImageStatus.READY)
+        self.assertEqual(repost.renditions, blob.renditions)
+
+        storage = blob.image.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            repost.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(storage.exists(blob.image.name))
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_lost_image_tasks_are_requeued(self):
+        self.client.login(username=self.username, password=self.password)
+        # The process dies before the renditions task runs
+        with self.captureOnCommitCallbacks(execute=False):
+            self.client.post(reverse('create_post'), {
+                'description': 'Lost', 'image': self._create_test_image(self), 'tags': 'tag1'
+            })
+        post = Post.objects.get(description='Lost')
+        output = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('requeue_images', stdout=output)
+        self.assertEqual(output.getvalue(), '0 images requeued\n')
+
+        lost_at = timezone.now() - timedelta(seconds=settings.IMAGE_PROCESSING_TIMEOUT + 1)
+        ImageBlob.objects.update(status_changed_at=lost_at)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('requeue_images', stdout=output)
+        post.refresh_from_db()
+        self.assertEqual(post.image_status, ImageStatus.READY)
+
+        # A new upload of the same bytes queues a blob stuck in processing again
+        ImageBlob.objects.update(status=ImageStatus.PROCESSING, status_changed_at=lost_at)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('settings', kwargs={'username': self.username}), {
+                'username': self.username, 'first_name': '', 'last_name': '', 'biography': '', 'email': '',
+                'image': self._create_test_image(self),
+            })
+        self.assertEqual(ImageBlob.objects.get().status, ImageStatus.READY)
+
+    def test_losing_a_blob_race_keeps_the_winners_file(self):
+        storage = ImageBlob._meta.get_field('image').storage
+        name = storage.save('images/ra/race.jpg', self._create_test_image(self))
+        ImageBlob.objects.create(digest='race', image=name)
+
+        # An overwriting storage stored the loser under the winner's name
+        images._discard_duplicate(ImageBlob(digest='race', image=name))
+        self.assertTrue(storage.exists(name))
+        # A renaming storage stored a second copy
+        copy = storage.save('images/ra/race.jpg', self._create_test_image(self))
+        images._discard_duplicate(ImageBlob(digest='race', image=copy))
+        self.assertNotEqual(copy, name)
+        self.assertFalse(storage.exists(copy))
+        self.assertTrue(storage.exists(name))
+
+    @staticmethod
+    def _pattern_image(size, mirrored=False, fmt='JPEG'):
+        """The same blurry random pattern at any size, a picture with enough texture to hash."""
+        img = Image.frombytes('L', (16, 12), random.Random(0).randbytes(192))
+        img = img.resize(size, Image.Resampling.BICUBIC).convert('RGB')
+        if mirrored:
+            img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        img_io = io.BytesIO()
+        img.save(img_io, format=fmt)
+        return SimpleUploadedFile(f'pattern.{fmt.lower()}', img_io.getvalue())
 
+    @staticmethod
+    def _flat_image(color):
+        img_io = io.BytesIO()
+        Image.new('RGB', (400, 300), color).save(img_io, format='JPEG')
+        return SimpleUploadedFile('flat.jpg', img_io.getvalue())
 
+    def test_near_duplicate_images(self):
+        original = phash.dhash(self._pattern_image((400, 300)))
+        self.assertLessEqual(phash.hamming(original, phash.dhash(self._pattern_image((200, 150), fmt='PNG'))), 6)
+        self.assertGreater(phash.hamming(original, phash.dhash(self._pattern_image((400, 300), mirrored=True))), 6)
+
+        self.client.login(username=self.username, password=self.password)
+        self.client.post(reverse('create_post'), {
+            'description': 'Original', 'image': self._pattern_image((400, 300)), 'tags': 'tag1'
+        })
+        post = Post.objects.get(description='Original')
+        self.assertEqual(phash.to_unsigned(post.phash), original)
+        self.assertEqual(phash.near_duplicates(Post.objects.all(), original), [(0, post)])
+
+        response = self.client.post(reverse('create_post'), {
+            'description': 'Resized', 'image': self._pattern_image((200, 150), fmt='PNG'), 'tags': 'tag1'
+        })
+        self.assertEqual(response.context['form'].errors['image'], ['You have already posted this image.'])
+
+        # Another user's repost is allowed but collapsed in the feed
+        Post.objects.create(description='Repost', user=User.objects.create(username='other'),
+                            **phash.hash_fields(original))
+        posts = self.client.get(reverse('index')).context['posts']
+        self.assertEqual([p.description for p in posts], ['Repost', 'Test description'])
+
+    def test_flat_images_are_not_near_duplicates(self):
+        self.assertFalse(phash.distinctive(phash.dhash(self._flat_image('red'))))
+        self.client.login(username=self.username, password=self.password)
+        for color in ('red', 'blue'):
+            self.client.post(reverse('create_post'), {
+                'description': f'Flat {color}', 'image': self._flat_image(color), 'tags': 'tag1'
+            })
+        self.assertEqual(Post.objects.filter(description__startswith='Flat').count(), 2)
+        posts = self.client.get(reverse('index')).context['posts']
+        self.assertEqual([p.description for p in posts], ['Flat blue', 'Flat red', 'Test description'])
+
+    def test_feed_card_fragments_are_cached_until_the_post_changes(self):
+        self.client.login(username=self.username, password=self.password)
+
+        def key():
+            self.post.refresh_from_db()
+            return fragments.card_key(self.post.id, self.post.updated_at)
+
+        first = key()
+        self.client.get(reverse('index'))
+        self.assertIn('Test description', cache.get(first)['details'])
+
+        # Counters are rendered outside the fragment
+        self.client.get(reverse('like_post', kwargs={'post_id': self.post.id}))
+        self.assertEqual(key(), first)
+        self.assertIn('<span class="likes-count">1</span>', self.client.get(reverse('index')).content.decode())
+
+        # Another process's cache still holding the old version does not matter, the key moved
+        stale = cache.get(first)
+        self.client.post(reverse('edit_description', kwargs={'post_id': self.post.id}), {'description': 'Edited'})
+        cache.set(first, stale)
+        self.assertNotEqual(key(), first)
+        self.assertContains(self.client.get(reverse('index')), 'Edited')
+
+        edited = key()
+        self.client.post(reverse('create_tags', kwargs={'post_id': self.post.id}), {'tags': 'fresh'})
+        self.assertNotEqual(key(), edited)
+        self.assertIsNone(cache.get(edited))
+        self.assertContains(self.client.get(reverse('index')), '#fresh')
+
+    def test_tags_are_normalized_and_upserted_in_bulk(self):
+        with self.assertNumQueries(2):
+            tags = Tag.objects.bulk_upsert([' Travel', '#travel', 'New  York', '', '123'])
+        self.assertEqual([tag.name for tag in tags], ['travel', 'new york', '123'])
+        self.assertEqual(Tag.objects.get(name='123').id, tags[2].id)
+
+        self.client.login(username=self.username, password=self.password)
+        self.client.post(reverse('create_tags', kwargs={'post_id': self.post.id}), {'tags': 'TRAVEL, travel '})
+        self.assertEqual(list(self.post.tags.order_by('name').values_list('name', flat=True)), ['123', 'travel'])
+        self.assertContains(self.client.get(reverse('tag_page', kwargs={'name': 'Travel'})), 'Test description')
+
+    def test_trending_tags_decay_and_count_only_new_posts(self):
+        now = timezone.now()
+        self.assertEqual(discovery.refresh_trending(now), 1)
+        self.assertEqual(TagTrend.objects.get(tag__name='123').score, 1)
+
+        for i in range(3):
+            post = Post.objects.create(description=f'Trip {i}', user=self.user)
+            post.tags.add(*Tag.objects.bulk_upsert(['travel']))
+        # One half-life later the old tag counts half, links are never counted twice
+        self.assertEqual(discovery.refresh_trending(now + settings.TRENDING_HALF_LIFE), 1)
+        self.assertAlmostEqual(TagTrend.objects.get(tag__name='123').score, 0.5)
+        self.assertEqual(TagTrend.objects.get(tag__name='travel').score, 3)
+        self.assertEqual([tag.name for tag in discovery.trending_tags()], ['travel', '123'])
+
+        self.client.login(username=self.username, password=self.password)
+        self.assertContains(self.client.get(reverse('index')), 'href="/tags/travel"')
+
+    @override_settings(TAG_INDEX_TTL=0)
+    def test_tag_autocomplete(self):
+        Tag.objects.bulk_upsert(['travel', 'trains', 'tree', 'art'])
+        Post.objects.create(description='Trip', user=self.user).tags.add(Tag.objects.get(name='trains'))
+
+        response = self.client.get(reverse('tag_autocomplete'), {'q': ' TR'})
+        self.assertEqual(response.json(), {'tags': ['trains', 'travel', 'tree']})
+        self.assertEqual(discovery.tag_index().complete('tra', limit=1), ['trains'])
+        self.assertEqual(discovery.tag_index().complete(''), [])
+
+    def test_search_ranks_posts_and_users(self):
+        search.InvertedIndexBackend.reset()
+        sunset = Post.objects.create(description='Sunset over the sea', user=self.user)
+        sunsets = Post.objects.create(description='Sunset sunset and a sunset', user=self.user)
+        commented = Post.objects.create(description='Beach', user=self.user)
+        Comment.objects.create(post=commented, user=self.user, text='What a sunset')
+        User.objects.create(username='sunset_lover', nickname='Sea')
+
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.get(reverse('search'), {'q': 'Sunset'})
+        self.assertEqual(list(response.context['posts']), [sunsets, sunset, commented])
+        self.assertEqual([user.username for user in response.context['found_users']], ['sunset_lover'])
+
+        # Indexed on save, removed on delete
+        sunset.description = 'Sunrise'
+        sunset.save()
+        sunsets.delete()
+        response = self.client.get(reverse('search'), {'q': 'sunset'})
+        self.assertEqual(list(response.context['posts']), [commented])
+
+        for i in range(12):
+            Post.objects.create(description=f'Sunrise {i}', user=self.user)
+        response = self.client.get(reverse('search'), {'q': 'sunrise'})
+        cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('search'), {'q': 'sunrise', 'cursor': cursor, 'format': 'json'})
+        self.assertEqual(response.json()['html'].count('class="card"'), 3)
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'sun'}).context['found_users'][0].username,
+                         'sunset_lover')
+
+    def test_like_and_follow_toggles_are_race_free(self):
+        self.client.login(username=self.username, password=self.password)
+        url = reverse('like_post', kwargs={'post_id': self.post.id})
+        self.assertEqual(self.client.post(url).json()['likes_count'], 1)
+        self.assertEqual(self.client.post(url).json()['likes_count'], 0)
+
+        # A concurrent toggle inserted the same like after our delete found nothing
+        LikePost.objects.create(post=self.post, user=self.user)
+        with mock.patch.object(ToggleQuerySet, 'delete', return_value=(0, {})):
+            self.assertEqual(LikePost.objects.toggle(post=self.post, user=self.user), (True, False))
+        self.assertEqual(LikePost.objects.filter(post=self.post).count(), 1)
+
+        other = User.objects.create(username='other')
+        follow = reverse('follow_user', kwargs={'user_id': other.id})
+        self.assertTrue(self.client.post(follow).json()['is_following'])
+        self.assertFalse(self.client.post(follow).json()['is_following'])
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_post_page_like_state_is_batched(self):
+        comments = [Comment.objects.create(post=self.post, user=self.user, text=f'Comment {i}') for i in range(3)]
+        LikePost.objects.create(post=self.post, user=self.user)
+        LikeComment.objects.create(comment=comments[1], user=self.user)
+        self.client.login(username=self.username, password=self.password)
+        url = reverse('post_page', kwargs={'post_id': self.post.id})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertTrue(response.context['post'].liked_by_me)
+        self.assertEqual([c.liked_by_me for c in response.context['comments']], [False, True, False])
+
+        for i in range(10):
+            Comment.objects.create(post=self.post, user=User.objects.create(username=f'user{i}'), text='More')
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
+    @override_settings(LIKE_WRITE_BEHIND=True, LIKE_BUFFER_INTERVAL=60)
+    def test_write_behind_likes_are_flushed_in_batches(self):
+        url = reverse('like_post', kwargs={'post_id': self.post.id})
+        users = [User.objects.create(username=f'fan{i}') for i in range(3)]
+        LikePost.objects.create(post=self.post, user=users[0])
+        Post.objects.filter(id=self.post.id).update(likes_count=1)
+
+        self.client.force_login(users[0])
+        self.assertEqual(self.client.post(url).json(), {'success': True, 'liked': False, 'likes_count': 0})
+        for user in users[1:]:
+            self.client.force_login(user)
+            self.assertTrue(self.client.post(url).json()['liked'])
+        self.assertEqual(self.client.post(url).json(), {'success': True, 'liked': False, 'likes_count': 1})
+        self.assertEqual(self.client.post(url).json()['likes_count'], 2)
+        self.assertEqual(LikePost.objects.filter(post=self.post).count(), 1)
+
+        with self.assertNumQueries(5):  # savepoint, insert, delete, recount, release
+            self.assertEqual(like_buffer.buffer.flush(), 3)
+        self.assertEqual(set(self.post.likes.values_list('user__username', flat=True)), {'fan1', 'fan2'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 2)
+        self.assertEqual(like_buffer.buffer.flush(), 0)
+
+    @override_settings(LIKE_BUFFER_INTERVAL=60)
+    def test_failed_like_flush_is_put_back_and_rescheduled(self):
+        buffer = like_buffer.LikeBuffer()
+        fans = [User.objects.create(username=f'fan{i}') for i in range(2)]
+        for fan in fans:
+            buffer.toggle(self.post, fan)
+
+        def unlike_then_fail(*args, **kwargs):
+            # fan0 unlikes while the flush is writing their like
+            self.assertEqual(buffer.toggle(self.post, fans[0]), (False, -1))
+            raise DatabaseError('connection lost')
+
+        with mock.patch.object(LikePost.objects, 'bulk_create', side_effect=unlike_then_fail):
+            with self.assertRaises(DatabaseError), self.assertLogs('posts.like_buffer', 'ERROR'):
+                buffer.flush()
+        self.assertIsNotNone(buffer._timer)
+        self.assertEqual(buffer.toggle(self.post, fans[1]), (False, 0))
+        self.assertEqual(buffer.toggle(self.post, fans[1]), (True, 1))
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertIsNone(buffer._timer)
+        self.assertEqual(list(self.post.likes.values_list('user', flat=True)), [fans[1].pk])
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_follow_counters_and_cached_is_following(self):
+        other = User.objects.create(username='other')
+        self.client.login(username=self.username, password=self.password)
+        follow = reverse('follow_user', kwargs={'user_id': other.id})
+        profile = reverse('user_page', kwargs={'username': 'other'})
+
+        self.assertFalse(self.client.get(profile).context['is_following'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(follow)
+        other.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual((other.followers_count, self.user.following_count), (1, 1))
+
+        self.assertTrue(self.client.get(profile).context['is_following'])
+        with self.assertNumQueries(0):
+            self.assertEqual(graph.followed_ids(self.user), {other.id})
+
+        # Another process whose cache still has the set from before the unfollow does not read it
+        before = graph.followed_ids(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(follow)
+        cache.set(f'followed_ids:{self.user.pk}:{self.user.follows_version}', before)
+        self.assertFalse(self.client.get(profile).context['is_following'])
+
+        self.client.logout()
+        self.assertEqual(self.client.get(profile).status_code, 200)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_follow_suggestions_are_friends_of_friends(self):
+        alice, bob, carol, dave = (User.objects.create(username=name) for name in ('alice', 'bob', 'carol', 'dave'))
+        for follower, followed in ((alice, carol), (bob, carol), (bob, dave), (self.user, dave)):
+            Subscription.objects.create(follower=follower, followed=followed)
+        Post.objects.create(description='Tagged', user=carol).tags.add(Tag.objects.get(name='123'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for friend in (alice, bob):
+                graph.toggle_follow(self.user, friend)
+        suggestions = list(graph.suggestions_for(self.user))
+        self.assertEqual([(s.candidate, s.mutual_count, s.shared_tags_count) for s in suggestions], [(carol, 2, 1)])
+
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.get(reverse('user_page', kwargs={'username': self.username}))
+        self.assertEqual(list(response.context['suggestions']), suggestions)
+
+        # Following carol changes her row among the suggestions of the user's followers, once per queued change
+        eve = User.objects.create(username='eve')
+        Subscription.objects.create(follower=eve, followed=self.user)
+        with mock.patch.object(graph, 'refresh_suggestions', wraps=graph.refresh_suggestions) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                for _ in range(3):
+                    graph.toggle_follow(self.user, carol)
+        refresh.assert_called_once_with([self.user.pk])
+        self.assertEqual([(s.candidate, s.mutual_count) for s in graph.suggestions_for(eve)], [(carol, 1)])
+        self.assertEqual(list(graph.suggestions_for(self.user)), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            graph.toggle_follow(self.user, carol)
+        self.assertEqual(list(graph.suggestions_for(eve)), [])
+        self.assertEqual([s.candidate for s in graph.suggestions_for(self.user)], [carol])
+
+    def test_graph_bulk_operations(self):
+        others = [User.objects.create(username=f'other{i}') for i in range(3)]
+        Post.objects.create(description='By other0', user=others[0])
+        Subscription.objects.create(follower=others[1], followed=self.user)
+
+        with self.assertNumQueries(8):
+            self.assertEqual(graph.follow_many(self.user, [*others, self.user]), 3)
+        self.assertEqual(graph.follow_many(self.user, others), 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.following_count, 3)
+        self.assertEqual(set(graph.following(self.user)), set(others))
+        self.assertEqual(list(graph.followers(self.user)), [others[1]])
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user, post__user=others[0]).exists())
+
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(graph.is_following_many(self.user, others[:2]), {others[0].id, others[1].id})
+        with self.assertNumQueries(1):
+            self.assertEqual(graph.mutual_follows(self.user), {others[1].id})
+
+        self.client.login(username=self.username, password=self.password)
+        self.assertTrue(self.client.get(reverse('user_page', kwargs={'username': 'other1'})).context['follows_you'])
+
+    @override_settings(COMMENTS_PAGE_SIZE=2, COMMENTS_PAGE_MAX_SIZE=3)
+    def test_post_comments_are_paginated(self):
+        comments = [Comment.objects.create(post=self.post, user=self.user, text=f'Comment {i}') for i in range(5)]
+        Post.objects.filter(id=self.post.id).update(comments_count=5)
+        self.client.login(username=self.username, password=self.password)
+
+        response = self.client.get(reverse('post_page', kwargs={'post_id': self.post.id}))
+        self.assertEqual(response.context['comments'], comments[:2])
+        cursor = response.context['comments_page'].next_cursor
+
+        url = reverse('post_comments', kwargs={'post_id': self.post.id})
+        with self.assertNumQueries(5):
+            data = self.client.get(url, {'cursor': cursor, 'limit': 50}).json()
+        self.assertEqual([c in data['html'] for c in ('Comment 1', 'Comment 2', 'Comment 4')], [False, True, True])
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(self.client.get(url, {'limit': 'all'}).status_code, 400)
+
+    @override_settings(REQUEST_BUDGETS={'*': {'queries': 100}, 'post_page': {'queries': 1}}, SERVER_TIMING_HEADER=False)
+    def test_request_metrics_and_budgets(self):
+        middleware.stats.reset()
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.get(reverse('request_stats'))
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('Server-Timing', response)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+
+        with self.assertLogs('posts.middleware', 'WARNING') as logs:
+            response = self.client.get(reverse('post_page', kwargs={'post_id': self.post.id}))
+        self.assertEqual(len(logs.records), 1)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, ')
+        self.client.get(reverse('index'))
+        self.assertRegex(self.client.get(reverse('index'))['Server-Timing'], r'cache;desc="[1-9]\d* hits, 0 misses"')
+
+        # A view that never loads the user gets no header rather than a session and a user query
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('tag_autocomplete'), {'q': '1'})
+        self.assertNotIn('Server-Timing', response)
+        self.assertFalse([query for query in captured if 'django_session' in query['sql']])
+
+        views = self.client.get(reverse('request_stats')).json()['views']
+        self.assertEqual((views['post_page']['count'], views['post_page']['over_budget']), (1, 1))
+        self.assertEqual((views['index']['count'], views['index']['over_budget']), (2, 0))
+        self.assertEqual(sum(views['index']['queries']['buckets'].values()), 2)
+
+    def test_benchmark_seed_and_run(self):
+        self.assertEqual(list(search.get_backend().posts('benchmark')), [])
+        call_command('seed_benchmark', users=20, posts=60, tags=5, comments=50, likes=300, comment_likes=40, follows=100,
+                     batch_size=25, stdout=io.StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='bench_').count(), 20)
+        post = Post.objects.filter(user__username__startswith='bench_').order_by('-likes_count').first()
+        self.assertEqual(post.likes_count, post.likes.count())
+        self.assertLess(Post.objects.order_by('created_at').first().created_at, timezone.now() - timedelta(days=1))
+        follower = User.objects.order_by('-following_count').first()
+        self.assertEqual(set(TimelineEntry.objects.filter(user=follower).values_list('post', flat=True)),
+                         set(Post.objects.filter(user__followers__follower=follower).values_list('id', flat=True)))
+        self.assertIn(post, search.get_backend().posts('benchmark'))
+
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            call_command('run_benchmark', rounds=3, warmup=1, output=output.name, stdout=io.StringIO())
+            results = json.load(output)
+        self.assertEqual(set(results['scenarios']), {'index', 'user_page', 'tag_page', 'post_page', 'reactions_page',
+                                                     'like_toggle', 'follow_toggle'})
+        self.assertTrue(all(result['queries'] > 0 for result in results['scenarios'].values()))
+        author = User.objects.filter(username__startswith='bench_').order_by('-followers_count', 'pk').first()
+        self.assertEqual(results['scenarios']['reactions_page']['user'], author.username)
+        self.assertNotEqual(results['scenarios']['index']['user'], author.username)
+        self.assertEqual(post.likes.count(), Post.objects.get(pk=post.pk).likes_count)
+        self.assertEqual([benchmark._percentile(range(1, 21), 0.95), benchmark._percentile([7], 0.95)], [19, 7])
+
+        # Flushing loads no generated row and fixes the rows of other users it touched
+        author = post.user
+        blob = ImageBlob.objects.create(digest='bench', image='images/be/bench.jpg', ref_count=1)
+        User.objects.filter(pk=author.pk).update(image_blob=blob)
+        Comment.objects.create(post=self.post, user=author, text='Bench comment')
+        Post.objects.filter(pk=self.post.pk).update(comments_count=1)
+        graph.toggle_follow(self.user, author)
+        with mock.patch.object(search.InvertedIndexBackend, 'remove') as remove:
+            self.assertGreater(datagen.flush(), 300)
+        remove.assert_not_called()
+        self.assertFalse(User.objects.filter(username__startswith='bench_').exists())
+        self.assertFalse(Tag.objects.filter(name__startswith='bench_').exists())
+        self.assertFalse(ImageBlob.objects.filter(pk=blob.pk).exists())
+        self.user.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual((self.user.following_count, self.post.comments_count), (0, 0))
+
+    def test_datagen_distributions_and_copy_lines(self):
+        rng = random.Random(0)
+        ranks = Counter(datagen.zipf(rng, 1000, datagen.ACTIVITY_EXPONENT) for _ in range(10000))
+        self.assertEqual(min(ranks), 0)
+        self.assertLess(max(ranks), 1000)
+        self.assertGreater(ranks[0], 10 * ranks[100])
+        self.assertEqual(datagen.row_uuid(1, 'post', 5), datagen.row_uuid(1, 'post', 5))
+
+        user = User(id=datagen.row_uuid(0, 'user', 0), username='tab\tuser', nickname='a\\b\nc')
+        names = ('id', 'username', 'nickname', 'biography', 'renditions', 'is_active')
+        fields = [User._meta.get_field(name) for name in names]
+        stream = datagen._CopyStream(iter(['\t'.join(datagen._copy_text(f, user) for f in fields) + '\n'] * 3))
+        line = f'{user.id}\ttab\\tuser\ta\\\\b\\nc\t\\N\t{{}}\tTrue\n'
+        self.assertEqual(stream.read(5) + stream.read(), line * 3)
+        self.assertEqual((stream.read(), stream.count), ('', 3))
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_hot_queries_use_indexes(self):
+        datagen.generate({'users': 30, 'posts': 200, 'tags': 10, 'comments': 300, 'likes': 600,
+                          'comment_likes': 100, 'follows': 200})
+        users = User.objects.filter(username__startswith=datagen.PREFIX)
+        viewer = users.order_by('-following_count').first()
+        author = users.order_by('-followers_count').first()
+        post = Post.objects.order_by('-comments_count').first()
+        tag = Tag.objects.filter(name__startswith=datagen.PREFIX).first()
+        comment = post.comments.first()
+        self.client.force_login(viewer)
+
+        requests = [
+            ('get', reverse('index')),
+            ('get', reverse('following')),
+            ('get', reverse('user_page', kwargs={'username': author.username})),
+            ('get', reverse('tag_page', kwargs={'name': tag.name})),
+            ('get', reverse('post_page', kwargs={'post_id': post.id})),
+            ('get', reverse('post_comments', kwargs={'post_id': post.id})),
+            ('get', reverse('reactions_page', kwargs={'username': author.username})),
+            ('post', reverse('like_post', kwargs={'post_id': post.id})),
+            ('post', reverse('like_comment', kwargs={'comment_id': comment.id})),
+            ('post', reverse('follow_user', kwargs={'user_id': author.id})),
+        ]
+        with CaptureQueriesContext(connection) as captured:
+            for method, url in requests:
+                self.assertLess(getattr(self.client, method)(url).status_code, 400, url)
+        selects = {query['sql'] for query in captured if query['sql'].startswith('SELECT')}
+        self.assertTrue(selects)
+
+        tables = set(connection.introspection.table_names())
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Seeded tables are small enough for the planner to scan them anyway, only a missing index should
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                explain, scan = 'EXPLAIN ', r'Seq Scan on (\w+)'
+            else:
+                explain, scan = 'EXPLAIN QUERY PLAN ', r'\bSCAN (\w+)$'
+            for sql in selects:
+                cursor.execute(explain + sql)
+                plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+                scans = [table for table in re.findall(scan, plan, re.MULTILINE) if table in tables]
+                self.assertEqual(scans, [], f'{sql}\nscans a whole table:\n{plan}')
@@ -0,0 +1,89 @@
+"""
+Home timeline of followed users.
+
+Posts are pushed (fan-out on write) into a TimelineEntry row per follower by a background task queued when
+they are created, so posting does not wait on the author's followers.
+Authors with more than TIMELINE_FANOUT_LIMIT followers are switched to fan-out on read: their posts
+are not copied anywhere and are merged into each follower's timeline when it is read.
+"""
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import Post, Subscription, TimelineEntry, User
+from .pagination import CursorPaginator
+from .tasks import enqueue
+
+BATCH_SIZE = 1000
+
+
+def fan_out(post):
+    """Push a new post into the timelines of its author's followers, returns the number of rows written."""
+    author = post.user
+    if not author.fanout_on_read:
+        if author.followers_count > settings.TIMELINE_FANOUT_LIMIT:
+            User.objects.filter(id=author.id).update(fanout_on_read=True)
+            author.fanout_on_read = True
+    if author.fanout_on_read:
+        return 0
+
+    follower_ids = Subscription.objects.filter(followed=author).values_list('follower_id', flat=True)
+    entries = (TimelineEntry(user_id=follower_id, post=post, created_at=post.created_at)
+               for follower_id in follower_ids.iterator(chunk_size=BATCH_SIZE))
+    return len(TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True))
+
+
+def fan_out_later(post):
+    """Queue fan_out() of a new post, run once it is committed."""
+    enqueue(_fan_out_post, post.pk)
+
+
+def _fan_out_post(post_id):
+    post = Post.objects.select_related('user').filter(pk=post_id).first()
+    # Deleted before the task ran
+    if post is not None:
+        fan_out(post)
+
+
+def backfill(follower, followed):
+    """Copy the latest posts of a newly followed user into the follower's timeline."""
+    if followed.fanout_on_read:
+        return 0
+
+    posts = Post.objects.filter(user=followed).order_by('-created_at', '-id')[:settings.TIMELINE_BACKFILL_SIZE]
+    entries = [TimelineEntry(user=follower, post_id=post_id, created_at=created_at)
+               for post_id, created_at in posts.values_list('id', 'created_at')]
+    return len(TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True))
+
+
+def backfill_many(follower, followed_ids):
+    """backfill() for several newly followed users at once, one read and one write whatever their number."""
+    latest = Post.objects.filter(user__in=followed_ids, user__fanout_on_read=False).annotate(
+        rank=Window(RowNumber(), partition_by=F('user'), order_by=[F('created_at').desc(), F('id').desc()])
+    ).filter(rank__lte=settings.TIMELINE_BACKFILL_SIZE)
+    entries = [TimelineEntry(user=follower, post_id=post_id, created_at=created_at)
+               for post_id, created_at in latest.values_list('id', 'created_at')]
+    return len(TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True))
+
+
+def prune(follower, followed):
+    """Drop an unfollowed user's posts from the follower's timeline."""
+    return TimelineEntry.objects.filter(user=follower, post__user=followed).delete()[0]
+
+
+def home_timeline(user, cursor=None, size=10):
+    """
+    Posts of the next timeline page after `cursor` (at most `size` + 1 of them, enough to tell if there is
+    another page), merged from pushed timeline entries and the posts of followed fan-out-on-read authors.
+    """
+    ordering = ('-created_at', '-id')
+    pushed = CursorPaginator(
+        TimelineEntry.objects.filter(user=user), size, ('-created_at', '-post')
+    ).after(cursor).values('post_id')[:size + 1]
+
+    pulled_authors = User.objects.filter(followers__follower=user, fanout_on_read=True).values('id')
+    pulled = CursorPaginator(
+        Post.objects.filter(Q(user__in=pulled_authors) | Q(user=user)), size, ordering
+    ).after(cursor).values('id')[:size + 1]
+
+    return Post.objects.filter(Q(id__in=pushed) | Q(id__in=pulled))
@@ -3,6 +3,8 @@ from .views import *
 
 urlpatterns = [
     path('', IndexPageView.as_view(), name='index'),
+    path('following', FollowingPageView.as_view(), name='following'),
+    path('search', SearchPageView.as_view(), name='search'),
 
     path('users/<str:username>', UserPageView.as_view(), name='user_page'),
     path('users/<str:username>/update', UserProfileUpdateView.as_view(), name='settings'),
@@ -13,6 +15,7 @@ urlpatterns = [
 
     path('posts/<uuid:post_id>/', PostDetailView.as_view(), name='post_page'),
     path('posts/create', create_post_view, name='create_post'),
+    path('posts/<uuid:post_id>/comments', post_comments_view, name='post_comments'),
     path('posts/<uuid:post_id>/like', like_post_view, name='like_post'),
     path('posts/<uuid:post_id>/delete', delete_post_view, name='delete_post'),
     path('posts/<uuid:post_id>/edit', update_post_description_view, name='edit_description'),
@@ -25,7 +28,10 @@ urlpatterns = [
     path('comments/<int:comment_id>/delete', delete_comment_view, name='delete_comment'),
 
     path('tags/<str:name>', TagPageView.as_view(), name='tag_page'),
+    path('autocomplete/tags', tag_autocomplete_view, name='tag_autocomplete'),
 
     path('reactions/<str:username>', ReactPageView.as_view(), name='reactions_page'),
-    path('users/follow/<str:user_id>', follow_view, name='follow_user')
+    path('users/follow/<str:user_id>', follow_view, name='follow_user'),
+
+    path('stats/requests', request_stats_view, name='request_stats'),
 ]
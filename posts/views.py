@@ -1,18 +1,22 @@
+from django.conf import settings
 from django.contrib import auth
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.files.base import ContentFile
+from django.core.exceptions import BadRequest
+from django.db import transaction
+from django.db.models import F, Value
 from django.http import JsonResponse
+from django.template.loader import render_to_string
 from django.views.generic import ListView, DetailView, UpdateView
 from django.shortcuts import render, HttpResponseRedirect, get_object_or_404
 from django.urls import reverse, reverse_lazy
-from django.utils import timezone
-
-import os
-from PIL import Image
-from io import BytesIO
 
 from .forms import *
-from .models import Post, Tag, LikePost, Comment, LikeComment, Subscription
+from .models import normalize_tag, Post, Tag, LikePost, Comment, LikeComment
+from .activity import ActivityPaginator, reactions_to
+from .likes import attach_liked_by_me
+from .pagination import CursorPaginationMixin, CursorPaginator
+from . import discovery, graph, images, like_buffer, middleware, phash, search, timeline
 
 
 def login_view(request):
@@ -48,37 +52,53 @@ def logout_view(request):
     return HttpResponseRedirect(reverse('index'))
 
 
-class IndexPageView(ListView):
+class IndexPageView(CursorPaginationMixin, ListView):
     model = Post
     template_name = 'posts/index.html'
+    items_template_name = 'posts/post_list.html'
     context_object_name = 'posts'
-    paginate_by = 10
+    collapse_near_duplicates = True
 
     def get_queryset(self):
-        return Post.objects.all().order_by('-created_at')
+        return Post.objects.feed(self.request.user)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['is_user_page'] = False
+        context['trending_tags'] = discovery.trending_tags()
         return context
 
 
-class UserPageView(ListView):
+class FollowingPageView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     model = Post
     template_name = 'posts/index.html'
+    items_template_name = 'posts/post_list.html'
+    context_object_name = 'posts'
+
+    def get_queryset(self):
+        posts = timeline.home_timeline(self.request.user, self.request.GET.get('cursor'), self.paginate_by)
+        return posts.feed(self.request.user)
+
+
+class UserPageView(CursorPaginationMixin, ListView):
+    model = Post
+    template_name = 'posts/index.html'
+    items_template_name = 'posts/post_list.html'
     context_object_name = 'posts'
-    paginate_by = 10
 
     def get_queryset(self):
         username = self.kwargs.get('username')
         self.user = get_object_or_404(User, username=username)
-        return Post.objects.filter(user=self.user).order_by('-created_at')
+        return Post.objects.filter(user=self.user).feed(self.request.user)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['is_user_page'] = True
         context['user'] = self.user
-        context['is_following'] = Subscription.objects.filter(follower=self.request.user, followed=self.user).exists()
+        context['is_following'] = self.user.pk in graph.followed_ids(self.request.user)
+        context['follows_you'] = self.request.user.pk in graph.followed_ids(self.user)
+        if self.request.user == self.user:
+            context['suggestions'] = graph.suggestions_for(self.user)
         return context
 
 
@@ -101,38 +121,51 @@ class UserProfileUpdateView(LoginRequiredMixin, UpdateView):
         form.instance.email = self.request.POST.get('email')
 
         if self.request.FILES.get('image'):
-            image = self.request.FILES.get('image')
-            new_filename = f"{self.request.user.id}_{self.request.user.username}_profileimage.jpg"
-
-            # Open, resize and save/update user image
-            img = Image.open(image)
-            img = img.convert('RGB')
-            img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-            img_io = BytesIO()
-            img.save(img_io, format='JPEG', quality=85)
-            img_content = ContentFile(img_io.getvalue(), new_filename)
-            if self.request.user.image:
-                if os.path.isfile(self.request.user.image.path):
-                    os.remove(self.request.user.image.path)
+            # Stored under its content hash, avatar renditions are generated in the background
+            images.attach_image(form.instance, self.request.FILES.get('image'))
 
-            form.instance.image.save(new_filename, img_content)
-        else:
-            form.instance.image = self.request.user.image
+        # Follow counters and follows_version change concurrently, never write back the values read above
+        form.instance.save(update_fields=['username', 'first_name', 'last_name', 'biography', 'email'])
+        return HttpResponseRedirect(self.get_success_url())
 
-        form.instance.save()
-        return super().form_valid(form)
 
-
-class TagPageView(ListView):
+class TagPageView(CursorPaginationMixin, ListView):
     model = Tag
     template_name = 'posts/index.html'
+    items_template_name = 'posts/post_list.html'
     context_object_name = 'posts'
-    paginate_by = 10
+    collapse_near_duplicates = True
 
     def get_queryset(self):
         name = self.kwargs.get('name')
-        tag = get_object_or_404(Tag, name=name)
-        return Post.objects.filter(tags__name=tag).order_by('-created_at')
+        tag = get_object_or_404(Tag, name=normalize_tag(name))
+        return Post.objects.filter(tags=tag).feed(self.request.user)
+
+
+class SearchPageView(CursorPaginationMixin, ListView):
+    model = Post
+    template_name = 'posts/index.html'
+    items_template_name = 'posts/post_list.html'
+    context_object_name = 'posts'
+    cursor_ordering = ('-rank', '-id')
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()
+        if not self.query:
+            return Post.objects.none().annotate(rank=Value(0.0))
+        return search.get_backend().posts(self.query).feed(self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search_query'] = self.query
+        if self.query and not self.request.GET.get('cursor'):
+            users = search.get_backend().users(self.query).order_by('-rank', 'username')
+            context['found_users'] = users[:settings.SEARCH_USERS_SHOWN]
+        return context
+
+
+def tag_autocomplete_view(request):
+    return JsonResponse({'tags': discovery.tag_index().complete(request.GET.get('q', ''))})
 
 
 class PostDetailView(DetailView):
@@ -141,11 +174,18 @@ class PostDetailView(DetailView):
     context_object_name = 'post'
     pk_url_kwarg = 'post_id'
 
+    def get_queryset(self):
+        return Post.objects.select_related('user').prefetch_related('tags')
+
     def get_object(self, queryset=None):
-        return super().get_object(queryset)
+        post = super().get_object(queryset)
+        attach_liked_by_me([post], self.request.user)
+        return post
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context['comments_page'] = comments_page(self.request, self.object)
+        context['comments'] = context['comments_page'].object_list
         context['post_id'] = self.object.id
         context['tags_form'] = AddPostTagsForm()
         context['comment_form'] = CommentForm()
@@ -153,31 +193,36 @@ class PostDetailView(DetailView):
         return context
 
 
-class ReactPageView(ListView):
-    template_name = 'posts/reactions.html'
-    context_object_name = 'reactions'
+def comments_page(request, post):
+    """A `?cursor=` page of a post's comments, oldest first, `?limit=` of them up to COMMENTS_PAGE_MAX_SIZE."""
+    try:
+        limit = int(request.GET.get('limit', settings.COMMENTS_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest('Invalid limit')
+    limit = max(1, min(limit, settings.COMMENTS_PAGE_MAX_SIZE))
+
+    paginator = CursorPaginator(post.comments.select_related('user'), limit, ('created_at', 'id'))
+    page = paginator.page(request.GET.get('cursor'))
+    page.object_list = attach_liked_by_me(page.object_list, request.user)
+    return page
 
-    def get_queryset(self):
-        user = self.request.user
-        user_posts = Post.objects.filter(user=user).order_by('-created_at')
-        user_comments = Comment.objects.filter(user=user).order_by('-created_at')
-        subscribes = Subscription.objects.filter(followed=user).order_by('-created_at')
-        all_reactions = []
 
-        for post in user_posts:
-            if post.comments.exists():
-                all_reactions.extend(post.comments.all())
-            if post.likes.exists():
-                all_reactions.extend(post.likes.all())
+def post_comments_view(request, post_id):
+    post = get_object_or_404(Post.objects.only('id'), id=post_id)
+    page = comments_page(request, post)
+    context = {'comments': page.object_list, 'comment_form': CommentForm()}
+    html = render_to_string('posts/comment_list.html', context, request)
+    return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
 
-        for comment in user_comments:
-            if comment.likes.exists():
-                all_reactions.extend(comment.likes.all())
 
-        all_reactions += subscribes
+class ReactPageView(LoginRequiredMixin, CursorPaginationMixin, ListView):
+    template_name = 'posts/reactions.html'
+    context_object_name = 'reactions'
+    paginator_class = ActivityPaginator
+    cursor_ordering = ('-created_at', '-kind', '-id')
 
-        all_reactions = sorted(all_reactions, key=lambda x: x.created_at, reverse=True)
-        return all_reactions
+    def get_queryset(self):
+        return reactions_to(self.request.user)
 
 
 def create_post_view(request):
@@ -186,29 +231,20 @@ def create_post_view(request):
         if form.is_valid():
             description = form.cleaned_data['description']
             image = form.cleaned_data['image']
-            tag_names = [tag.strip() for tag in form.cleaned_data['tags'].split(',')]
-            tags = [Tag.objects.get_or_create(name=tag_name)[0] for tag_name in tag_names]
-
-            # Generating unique image name
-            user_id = request.user.id
-            timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
-            filename, extension = os.path.splitext(image.name)
-            new_filename = f'{user_id}_{timestamp}{extension}'
-
-            # Changing image
-            img = Image.open(image)
-            img = img.convert('RGB')
-            img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-            img_io = BytesIO()
-            img.save(img_io, format='JPEG', quality=85)  # Save as JPEG with quality 85
-            img_content = ContentFile(img_io.getvalue(), new_filename)
-
-            # Saving Post
-            post = Post.objects.create(description=description, user=request.user)
-            post.image.save(new_filename, img_content)
-            post.tags.set(tags)
-
-            return HttpResponseRedirect(reverse_lazy('index'))
+            image_hash = phash.dhash(image)
+
+            if phash.near_duplicates(Post.objects.filter(user=request.user), image_hash):
+                form.add_error('image', 'You have already posted this image.')
+            else:
+                tags = Tag.objects.bulk_upsert(form.cleaned_data['tags'].split(','))
+
+                # Saving Post, the image is stored under its content hash and renditions are generated in the background
+                post = Post.objects.create(description=description, user=request.user, **phash.hash_fields(image_hash))
+                images.attach_image(post, image)
+                post.tags.set(tags)
+                timeline.fan_out_later(post)
+
+                return HttpResponseRedirect(reverse_lazy('index'))
     else:
         form = PostForm()
     return render(request, 'posts/create_post.html', {'form': form})
@@ -229,16 +265,17 @@ def like_post_view(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     user = request.user
 
-    if LikePost.objects.filter(post=post, user=user).exists():
-        LikePost.objects.get(post=post, user=user).delete()
-        liked = False
-    else:
-        like = LikePost(post=post, user=user)
-        like.save()
-        liked = True
+    if settings.LIKE_WRITE_BEHIND:
+        liked, pending = like_buffer.buffer.toggle(post, user)
+        return JsonResponse({'success': True, 'liked': liked, 'likes_count': post.likes_count + pending})
+
+    with transaction.atomic():
+        liked, changed = LikePost.objects.toggle(post=post, user=user)
+        if changed:
+            Post.objects.filter(id=post.id).update(likes_count=F('likes_count') + (1 if liked else -1))
 
-    likes_count = LikePost.objects.filter(post=post).count()
-    return JsonResponse({'success': True, 'liked': liked, 'likes_count': likes_count})
+    post.refresh_from_db(fields=['likes_count'])
+    return JsonResponse({'success': True, 'liked': liked, 'likes_count': post.likes_count})
 
 
 def create_tag_for_post_view(request, post_id):
@@ -246,10 +283,7 @@ def create_tag_for_post_view(request, post_id):
     if request.method == 'POST':
         form = AddPostTagsForm(request.POST)
         if form.is_valid():
-            tag_names = [tag.strip() for tag in form.cleaned_data['tags'].split(',')]
-            tags = [Tag.objects.get_or_create(name=tag_name)[0] for tag_name in tag_names]
-            for tag in tags:
-                post.tags.add(tag)
+            post.tags.add(*Tag.objects.bulk_upsert(form.cleaned_data['tags'].split(',')))
     return HttpResponseRedirect(reverse('post_page', kwargs={'post_id': post_id}))
 
 
@@ -266,7 +300,8 @@ def update_post_description_view(request, post_id):
         form = PostDescriptionForm(request.POST)
         if form.is_valid():
             post.description = form.cleaned_data['description']
-            post.save()
+            # Counters and image fields are updated concurrently, never write back the values read above
+            post.save(update_fields=['description', 'updated_at'])
     return HttpResponseRedirect(reverse('post_page', kwargs={'post_id': post_id}))
 
 
@@ -276,8 +311,9 @@ def create_comment_view(request, post_id):
         form = CommentForm(request.POST)
         if form.is_valid():
             text = form.cleaned_data['text']
-            comment = Comment.objects.create(text=text, user=request.user, post=post)
-            comment.save()
+            with transaction.atomic():
+                Comment.objects.create(text=text, user=request.user, post=post)
+                Post.objects.filter(id=post.id).update(comments_count=F('comments_count') + 1)
             return HttpResponseRedirect(reverse('post_page', kwargs={'post_id': post_id}))
     else:
         form = CommentForm()
@@ -290,7 +326,7 @@ def update_comment_view(request, comment_id):
     if request.method == 'POST':
         form = CommentForm(request.POST, instance=comment)
         if form.is_valid():
-            comment.save()
+            comment.save(update_fields=['text', 'updated_at'])
             return HttpResponseRedirect(reverse('post_page', kwargs={'post_id': post_id}))
     else:
         form = CommentForm()
@@ -302,11 +338,10 @@ def like_comment_view(request, comment_id):
     user = request.user
     post_id = comment.post.id
 
-    if LikeComment.objects.filter(comment=comment, user=user).exists():
-        LikeComment.objects.get(comment=comment, user=user).delete()
-    else:
-        like = LikeComment(comment=comment, user=user)
-        like.save()
+    with transaction.atomic():
+        liked, changed = LikeComment.objects.toggle(comment=comment, user=user)
+        if changed:
+            Comment.objects.filter(id=comment.id).update(likes_count=F('likes_count') + (1 if liked else -1))
 
     return HttpResponseRedirect(reverse('post_page', kwargs={'post_id': post_id}))
 
@@ -317,7 +352,10 @@ def delete_comment_view(request, comment_id):
     post_id = comment.post.id
 
     if user.id == comment.user.id:
-        comment.delete()
+        with transaction.atomic():
+            # A concurrent delete of the same comment already decremented the counter
+            if comment.delete()[0]:
+                Post.objects.filter(id=post_id).update(comments_count=F('comments_count') - 1)
 
     return HttpResponseRedirect(reverse('post_page', kwargs={'post_id': post_id}))
 
@@ -327,13 +365,13 @@ def follow_view(request, user_id):
     followed = get_object_or_404(User, id=user_id)
 
     if follower != followed:
-        if Subscription.objects.filter(follower=follower, followed=followed).exists():
-            Subscription.objects.filter(follower=follower, followed=followed).delete()
-            is_following = False
-        else:
-            Subscription.objects.create(follower=follower, followed=followed)
-            is_following = True
+        is_following, _ = graph.toggle_follow(follower, followed)
     else:
         is_following = False
 
     return JsonResponse({'success': True, 'is_following': is_following})
+
+
+@staff_member_required
+def request_stats_view(request):
+    return JsonResponse({'views': middleware.stats.snapshot(), 'budgets': settings.REQUEST_BUDGETS})